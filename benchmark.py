@@ -0,0 +1,499 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from telethon import utils
+from telethon.errors import FloodWaitError, UserAlreadyParticipantError
+from telethon.tl import functions, types
+
+# The scraper reads credentials at start-up; the fake client never uses them
+for name, value in (('TELEGRAM_API_ID', '1'), ('TELEGRAM_API_HASH', 'benchmark'), ('TELEGRAM_PHONE_NUMBER', '+10000000000')):
+    os.environ.setdefault(name, value)
+
+import bot
+from bot import MessageRecord, TelegramScraper, export_row
+
+def make_message(i, date, peer=None, senders=200, client=None, nested=False):
+    """
+    One synthetic Telethon message shaped like a busy airdrop group post.
+    Every fifth message replies to the one before it; with `nested` so
+    does every fourth, giving reply chains two deep.
+    """
+    media = None
+    if i % 7 == 0:
+        media = types.MessageMediaDocument(document=types.Document(
+            id=i, access_hash=0, file_reference=b'', date=date, mime_type='image/jpeg',
+            size=1024, dc_id=1, attributes=[]))
+    elif i % 11 == 0:
+        media = types.MessageMediaPhoto()
+
+    entities = None
+    if i % 13 == 0:
+        entities = [types.MessageEntityTextUrl(offset=0, length=3, url=f"https://project{i % 40}.xyz/claim")]
+
+    message = types.Message(
+        id=i,
+        peer_id=peer or types.PeerChannel(1),
+        date=date,
+        message=f"New airdrop #{i}: join https://t.me/+hash{i % 50} and follow @project{i % 30}",
+        from_id=types.PeerUser(1000 + i % senders),
+        reply_to=types.MessageReplyHeader(reply_to_msg_id=i - 1) if i % 5 == 0 or nested and i % 5 == 4 else None,
+        media=media,
+        entities=entities,
+        views=i,
+        forwards=i % 3
+    )
+    message._client = client
+    message._text = message.message
+    return message
+
+def make_messages(count, senders=200):
+    """
+    Build synthetic Telethon messages shaped like a busy airdrop group
+    """
+    now = datetime.now(timezone.utc)
+    return [make_message(i, now - timedelta(seconds=count - i), senders=senders) for i in range(1, count + 1)]
+
+class FakeDialog:
+    def __init__(self, entity, name, date):
+        self.entity = entity
+        self.name = name
+        self.id = utils.get_peer_id(entity)
+        self.date = date
+        self.pinned = False
+
+class FakeTelegramClient:
+    """
+    Stand-in for TelegramClient serving one synthetic group.
+    History pages are generated on request from message ids (dates are
+    spread evenly over `span_days`), so large histories cost no memory
+    up front. Every request sleeps `latency` seconds and every
+    `flood_every`-th history request raises a one second FloodWait.
+    Calls are counted by name in `calls`. `nested` builds two deep reply
+    chains (see make_message).
+    """
+    def __init__(self, messages=1000, senders=200, dialogs=20, latency=0.0, flood_every=0, span_days=150,
+                 nested=False):
+        self.count = messages
+        self.nested = nested
+        self.latency = latency
+        self.flood_every = flood_every
+        self.parse_mode = None
+        self.calls = {}
+        self.history_requests = 0
+
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.step = timedelta(days=span_days) / max(messages, 1)
+        self.group = types.Channel(id=777, title='Airdrop List Link', photo=types.ChatPhotoEmpty(),
+                                   date=self.now, access_hash=42, megagroup=True)
+        self.peer = types.PeerChannel(self.group.id)
+        self.users = {1000 + i: types.User(id=1000 + i, access_hash=i, first_name=f"User {i}",
+                                           username=f"user{i}" if i % 2 else None)
+                      for i in range(senders)}
+        self.senders = senders
+
+        words = ['crypto', 'airdrop', 'alpha', 'signals', 'nft', 'defi', 'hunters', 'news', 'chat', 'official']
+        self.dialogs = [FakeDialog(self.group, self.group.title, self.now)]
+        for i in range(1, dialogs):
+            channel = types.Channel(id=10_000 + i, title=f"{words[i % 10].title()} {words[(i * 7) % 10].title()} {i}",
+                                    photo=types.ChatPhotoEmpty(), date=self.now, access_hash=i, megagroup=bool(i % 2))
+            self.dialogs.append(FakeDialog(channel, channel.title, self.now - timedelta(minutes=i)))
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def date_of(self, message_id):
+        return self.now - self.step * (self.count - message_id)
+
+    async def __call__(self, request):
+        name = type(request).__name__
+        self._count(name)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(request, functions.messages.GetHistoryRequest):
+            self.history_requests += 1
+            if self.flood_every and self.history_requests % self.flood_every == 0:
+                raise FloodWaitError(request=request, capture=1)
+            return self._history(request)
+        if isinstance(request, functions.messages.ImportChatInviteRequest):
+            raise UserAlreadyParticipantError(request=request)
+        if isinstance(request, functions.messages.CheckChatInviteRequest):
+            return types.ChatInviteAlready(chat=self.group)
+        raise NotImplementedError(name)
+
+    def _history(self, request):
+        """Newest-first page of ids below every upper bound and above min_id"""
+        top = self.count
+        if request.offset_id:
+            top = min(top, request.offset_id - 1)
+        if request.max_id:
+            top = min(top, request.max_id - 1)
+        if request.offset_date:
+            # Newest id dated strictly before offset_date
+            before = (request.offset_date - self.date_of(0)) / self.step
+            top = min(top, int(before) if before != int(before) else int(before) - 1)
+        top -= request.add_offset
+        bottom = max(request.min_id + 1, top - request.limit + 1, 1)
+
+        messages = [make_message(i, self.date_of(i), self.peer, self.senders, self, self.nested)
+                    for i in range(top, bottom - 1, -1)]
+        users = [self.users[m.from_id.user_id] for m in messages]
+        return types.messages.ChannelMessages(pts=0, count=self.count, messages=messages, topics=[],
+                                              chats=[self.group], users=list({u.id: u for u in users}.values()))
+
+    def _entity(self, peer):
+        if isinstance(peer, int) and peer in self.users:
+            return self.users[peer]
+        for dialog in self.dialogs:
+            if peer in (dialog.id, dialog.entity.id) or getattr(peer, 'channel_id', None) == dialog.entity.id:
+                return dialog.entity
+        raise ValueError(f"Cannot find any entity corresponding to {peer}")
+
+    async def get_entity(self, peer):
+        self._count('get_entity')
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(peer, list):
+            return [self._entity(p) for p in peer]
+        return self._entity(peer)
+
+    async def get_input_entity(self, peer):
+        self._count('get_input_entity')
+        return utils.get_input_peer(self._entity(peer))
+
+    async def iter_dialogs(self, *args, **kwargs):
+        self._count('iter_dialogs')
+        for index, dialog in enumerate(self.dialogs):
+            if self.latency and index % 100 == 0:
+                await asyncio.sleep(self.latency)
+            yield dialog
+
+    async def start(self, phone=None):
+        self._count('start')
+
+    async def connect(self):
+        self._count('connect')
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_me(self):
+        self._count('get_me')
+        return types.User(id=1, first_name='Benchmark', username='benchmark')
+
+    async def disconnect(self):
+        self._count('disconnect')
+
+def make_scraper(client, unthrottled=True, max_in_flight=4, **options):
+    """TelegramScraper whose accounts all talk to the fake client"""
+    scraper = quiet(lambda: TelegramScraper(max_in_flight=max_in_flight, **options))
+    for account in scraper.pool.accounts:
+        account.client = client
+        if unthrottled:
+            # Measure the scraper, not the politeness delay
+            account.limiter.rate = account.limiter.max_rate = 10_000
+            account.limiter.burst = account.limiter.tokens = 10_000
+    return scraper
+
+def legacy_message_dict(message, sender_info):
+    """
+    The per-message dict extract_message_data built before MessageRecord,
+    kept here as the baseline
+    """
+    text = message.text if message.text else ""
+    media_type = None
+    media_info = ""
+    if message.media:
+        media_type = type(message.media).__name__
+        if hasattr(message.media, 'document') and hasattr(message.media.document, 'mime_type'):
+            media_info = message.media.document.mime_type
+
+    return {
+        'id': message.id,
+        'date': message.date.strftime('%Y-%m-%d %H:%M:%S'),
+        'sender': sender_info,
+        'text': text,
+        'media_type': media_type,
+        'media_info': media_info,
+        'reply_to': message.reply_to.reply_to_msg_id if message.reply_to else None,
+        'views': getattr(message, 'views', None),
+        'forwards': getattr(message, 'forwards', None),
+        'is_reply': bool(message.reply_to)
+    }
+
+def measure(build, messages, names):
+    """Time and retained memory for extracting every message with `build`"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    records = [build(m, names[m.sender_id]) for m in messages]
+    elapsed = time.perf_counter() - started
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    return records, {
+        'seconds': round(elapsed, 4),
+        'us_per_message': round(elapsed / len(messages) * 1e6, 3),
+        'bytes_per_message': round(retained / len(messages), 1),
+    }
+
+def bench_records(args):
+    """Extraction into per-message dicts versus MessageRecord"""
+    count = args.messages
+    messages = make_messages(count)
+    # One shared display string per sender, as SenderResolver hands out
+    names = {m.sender_id: f"@user{m.sender_id}" for m in messages}
+
+    _, legacy = measure(legacy_message_dict, messages, names)
+    records, compact = measure(MessageRecord.from_message, messages, names)
+
+    started = time.perf_counter()
+    for record in records:
+        export_row(record)
+    export_seconds = time.perf_counter() - started
+    compact['export_us_per_message'] = round(export_seconds / count * 1e6, 3)
+
+    return {
+        'scenario': 'records',
+        'messages': count,
+        'dict': legacy,
+        'record': compact,
+        'memory_ratio': round(legacy['bytes_per_message'] / compact['bytes_per_message'], 2),
+        'speedup': round(legacy['seconds'] / compact['seconds'], 2),
+    }
+
+def bench_backfill(args):
+    """Full scrape_group backfill of a synthetic group into the chosen format"""
+    client = FakeTelegramClient(messages=args.messages, latency=args.latency, flood_every=args.flood_every)
+    scraper = make_scraper(client, max_in_flight=args.max_in_flight)
+
+    async def run():
+        return await scraper.scrape_group('https://t.me/+benchmark', output_format=args.format,
+                                          months_back=6, shards=args.shards)
+
+    started = time.perf_counter()
+    total = quiet(lambda: asyncio.run(run()))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'scenario': 'backfill',
+        'messages': total,
+        'format': args.format,
+        'shards': args.shards,
+        'wall_seconds': round(elapsed, 3),
+        'messages_per_second': round(total / elapsed, 1),
+        'rpc_calls': sum(client.calls.values()),
+        'rpc_by_type': client.calls,
+        'sender_cache_misses': scraper.senders.misses,
+        'stage_seconds': {stage: round(histogram.sum, 3)
+                          for stage, histogram in sorted(bot.metrics.by_label('stage', 'stage').items())},
+    }
+
+def expected_thread(i):
+    """(thread_id, depth) of message i in a nested FakeTelegramClient"""
+    depth = 0
+    while i > 1 and i % 5 in (0, 4):
+        i -= 1
+        depth += 1
+    return i, depth
+
+def bench_threads(args):
+    """
+    Backfill of nested reply chains into SQLite with threads and the
+    analytics stage on, so parents often arrive while their replies'
+    batches are still queued for analysis; counts rows whose thread_id
+    or depth is wrong
+    """
+    client = FakeTelegramClient(messages=args.messages, latency=args.latency, nested=True)
+    scraper = make_scraper(client, max_in_flight=args.max_in_flight, threads=True,
+                           analytics=bot.AnalyticsStage(2))
+
+    async def run():
+        try:
+            return await scraper.scrape_group('https://t.me/+benchmark', output_format='sqlite',
+                                              months_back=6, shards=args.shards)
+        finally:
+            scraper.analytics.close()
+
+    started = time.perf_counter()
+    total = quiet(lambda: asyncio.run(run()))
+    elapsed = time.perf_counter() - started
+
+    with contextlib.closing(sqlite3.connect(scraper.archive_file)) as conn:
+        rows = conn.execute("SELECT id, thread_id, depth FROM messages").fetchall()
+    return {
+        'scenario': 'threads',
+        'messages': total,
+        'shards': args.shards,
+        'wall_seconds': round(elapsed, 3),
+        'messages_per_second': round(total / elapsed, 1),
+        'wrong_threads': sum(1 for message_id, thread_id, depth in rows
+                             if (thread_id, depth) != expected_thread(message_id)),
+    }
+
+def bench_dialogs(args):
+    """Dialog index build plus repeated group lookups by name and invite hash"""
+    client = FakeTelegramClient(messages=10, dialogs=args.dialogs, latency=args.latency)
+    scraper = make_scraper(client)
+
+    async def run():
+        started = time.perf_counter()
+        await scraper.refresh_dialogs()
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(args.lookups):
+            await scraper.find_group_in_dialogs()
+        lookups = time.perf_counter() - started
+        return build, lookups
+
+    started = time.perf_counter()
+    build, lookups = quiet(lambda: asyncio.run(run()))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'scenario': 'dialogs',
+        'messages': 0,
+        'dialogs': args.dialogs,
+        'lookups': args.lookups,
+        'wall_seconds': round(elapsed, 3),
+        'index_build_seconds': round(build, 4),
+        'us_per_lookup': round(lookups / args.lookups * 1e6, 1),
+        'rpc_calls': sum(client.calls.values()),
+        'rpc_by_type': client.calls,
+    }
+
+def bench_export(args):
+    """Stream synthetic records through the sinks of the chosen format"""
+    client = FakeTelegramClient(messages=0)
+    scraper = make_scraper(client)
+    sinks = scraper.create_sinks(args.format, 'benchmark_export', client.group)
+    now = int(time.time())
+    batch_size = 100
+
+    started = time.perf_counter()
+    for start in range(1, args.rows + 1, batch_size):
+        batch = [MessageRecord(i, now - args.rows + i, 1000 + i % 200, f"@user{i % 200}",
+                               f"New airdrop #{i}: join https://t.me/+hash{i % 50} and follow @project{i % 30}",
+                               bot.media_type_code(None), "", i - 1 if i % 5 == 0 else None, i, i % 3, i % 5 == 0)
+                 for i in range(start, min(start + batch_size, args.rows + 1))]
+        for sink in sinks:
+            sink.write_batch(batch)
+    for sink in sinks:
+        sink.close()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'scenario': 'export',
+        'messages': args.rows,
+        'format': args.format,
+        'wall_seconds': round(elapsed, 3),
+        'messages_per_second': round(args.rows / elapsed, 1),
+        'bytes_on_disk': sum(sink.disk_size() for sink in sinks),
+        'rpc_calls': 0,
+    }
+
+SCENARIOS = {
+    'records': bench_records,
+    'backfill': bench_backfill,
+    'dialogs': bench_dialogs,
+    'export': bench_export,
+    'threads': bench_threads,
+}
+
+def quiet(func):
+    """Run func with the scraper's progress output discarded"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return func()
+
+def peak_rss_mb():
+    """Peak resident memory of this process, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_scenario(name, args):
+    """Run one scenario in a scratch directory and add peak memory"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='scraper-bench-') as scratch:
+        os.chdir(scratch)
+        try:
+            result = SCENARIOS[name](args)
+        finally:
+            os.chdir(cwd)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def run_isolated(name, argv):
+    """Run a scenario in a fresh interpreter so its peak memory is its own"""
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', name, '--json'] + argv,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)[0]
+
+def scenario_options(args):
+    """Command line options to hand on to isolated scenario runs"""
+    return ['--messages', str(args.messages), '--dialogs', str(args.dialogs), '--lookups', str(args.lookups),
+            '--rows', str(args.rows), '--format', args.format, '--latency', str(args.latency),
+            '--flood-every', str(args.flood_every), '--shards', str(args.shards),
+            '--max-in-flight', str(args.max_in_flight)]
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Telegram scraper")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                        help="scenario to run (default: all)")
+    parser.add_argument('--messages', type=int, default=100_000, help="messages for the records, backfill and threads scenarios")
+    parser.add_argument('--dialogs', type=int, default=1000, help="dialogs for the dialogs scenario")
+    parser.add_argument('--lookups', type=int, default=200, help="group lookups for the dialogs scenario")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="rows for the export scenario")
+    parser.add_argument('--format', default='csv', help="output format for backfill and export")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated seconds per request")
+    parser.add_argument('--flood-every', type=int, default=0, help="raise a FloodWait every N history requests")
+    parser.add_argument('--shards', type=int, default=1, help="backfill shards")
+    parser.add_argument('--max-in-flight', type=int, default=4, help="cap on concurrent requests during backfill")
+    parser.add_argument('--json', action='store_true', help="print machine readable results")
+    parser.add_argument('--output', help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    names = args.scenario or sorted(SCENARIOS)
+    if len(names) == 1:
+        results = [run_scenario(names[0], args)]
+    else:
+        results = [run_isolated(name, scenario_options(args)) for name in names]
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'revision': git_revision(), 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for result in results:
+        print(f"📊 {result['scenario']} ({result['messages']} messages)")
+        for key, value in result.items():
+            if key not in ('scenario', 'messages'):
+                print(f"   {key}: {value}")
+
+if __name__ == "__main__":
+    main()
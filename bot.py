@@ -1,21 +1,2071 @@
+import argparse
 import asyncio
+import base64
+import bisect
+import contextlib
+import contextvars
+import copy
 import csv
+import gzip
+import io
 import json
+import logging
 import os
+import random
 import re
-from datetime import datetime, timedelta
-from telethon import TelegramClient
-from telethon.tl.functions.messages import GetHistoryRequest, ImportChatInviteRequest
+import sys
+import time
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from telethon import TelegramClient, events, utils
+from telethon.tl.functions.messages import GetHistoryRequest, ImportChatInviteRequest, CheckChatInviteRequest
 from telethon.tl.functions.channels import JoinChannelRequest
-from telethon.tl.types import PeerChannel, PeerUser, PeerChat
+from telethon.tl.types import PeerChannel, PeerUser, PeerChat, Channel, Chat, ChatPhotoEmpty
+from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, MessageEntityTextUrl, MessageEntityMentionName
 from telethon.errors import UserAlreadyParticipantError, InviteHashEmptyError, InviteHashExpiredError
+from telethon.errors import FloodWaitError, ServerError, RpcCallFailError
+from telethon.errors import ChannelPrivateError, ChannelInvalidError, ChatIdInvalidError, PeerIdInvalidError
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Structured progress events; silent unless logging is configured
+log = logging.getLogger('telegram_scraper')
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram in seconds, cheap enough to update on
+    every RPC. Quantiles are read back as the upper bound of the bucket
+    they fall into.
+    """
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+    
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.BOUNDS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+    
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 4), 'p50': round(self.quantile(0.5), 4),
+                'p95': round(self.quantile(0.95), 4), 'max': round(self.max, 4)}
+
+class Metrics:
+    """
+    Counters and latency histograms for RPCs and pipeline stages.
+    Series are keyed by name plus a few labels (method, stage, error),
+    and can be read as a JSON snapshot, as Prometheus text or as the
+    end-of-run summary.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.monotonic()
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+    
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def counter(self, name, **labels):
+        """Sum of a counter over every label set matching `labels`"""
+        wanted = set(labels.items())
+        return sum(value for (key, series), value in self.counters.items()
+                   if key == name and wanted <= set(series))
+    
+    def by_label(self, name, label):
+        """Histograms of one metric keyed by the value of one label"""
+        return {dict(series).get(label): histogram for (key, series), histogram in self.histograms.items()
+                if key == name}
+    
+    def snapshot(self):
+        """JSON-friendly view of every series"""
+        def series_name(name, series):
+            if not series:
+                return name
+            return name + '{' + ','.join(f"{k}={v}" for k, v in series) + '}'
+        
+        uptime = time.monotonic() - self.started
+        messages = self.counter('messages')
+        return {
+            'uptime': round(uptime, 1),
+            'messages_per_second': round(messages / uptime, 1) if uptime else 0.0,
+            'counters': {series_name(name, series): round(value, 4) if isinstance(value, float) else value
+                         for (name, series), value in sorted(self.counters.items())},
+            'latency': {series_name(name, series): histogram.summary()
+                        for (name, series), histogram in sorted(self.histograms.items())},
+        }
+    
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        def labels_text(series, extra=()):
+            pairs = list(series) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+        
+        lines = []
+        typed = set()
+        for (name, series), value in sorted(self.counters.items()):
+            metric = f"scraper_{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{labels_text(series)} {value}")
+        
+        for (name, series), histogram in sorted(self.histograms.items()):
+            metric = f"scraper_{name}_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip(Histogram.BOUNDS, histogram.buckets):
+                cumulative += n
+                lines.append(f"{metric}_bucket{labels_text(series, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_bucket{labels_text(series, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{metric}_sum{labels_text(series)} {histogram.sum}")
+            lines.append(f"{metric}_count{labels_text(series)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+    
+    async def serve(self, port, host='127.0.0.1'):
+        """Answer every HTTP request on host:port with the Prometheus text"""
+        async def handle(reader, writer):
+            try:
+                # Read the request head; the path does not matter
+                while (await reader.readline()).strip():
+                    pass
+                body = self.prometheus().encode()
+                writer.write(b"HTTP/1.1 200 OK\r\n"
+                             b"Content-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                             b"Connection: close\r\n\r\n" + body)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+        
+        return await asyncio.start_server(handle, host, port)
+    
+    async def report_every(self, interval):
+        """Log a JSON stats line every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            log.info(json.dumps({'event': 'stats', **self.snapshot()}))
+    
+    def summary_lines(self):
+        """Human readable end-of-run summary"""
+        uptime = time.monotonic() - self.started
+        messages = self.counter('messages')
+        lines = [f"📈 Run metrics ({uptime:.1f}s):",
+                 f"   📨 Messages: {messages} ({messages / uptime if uptime else 0:.1f} msg/s), "
+                 f"{self.counter('pages')} pages, {self.counter('rows_written')} rows written"]
+        
+        for method, histogram in sorted(self.by_label('rpc', 'method').items()):
+            errors = self.counter('rpc_errors', method=method)
+            lines.append(f"   🌐 {method}: {histogram.count} calls, p50 {histogram.quantile(0.5) * 1000:.0f}ms, "
+                         f"p95 {histogram.quantile(0.95) * 1000:.0f}ms, max {histogram.max * 1000:.0f}ms"
+                         + (f", {errors} errors" if errors else ""))
+        
+        lines.append(f"   ⏳ Time lost: {self.counter('rate_limit_wait'):.1f}s rate limiting, "
+                     f"{self.counter('flood_wait_seconds'):.1f}s in {self.counter('flood_waits')} flood waits, "
+                     f"{self.counter('backoff_seconds'):.1f}s backing off")
+        
+        stages = self.by_label('stage', 'stage')
+        if stages:
+            lines.append("   🧮 Stages: " + ", ".join(f"{stage} {histogram.sum:.2f}s"
+                                                    for stage, histogram in sorted(stages.items())))
+        return lines
+
+# Process-wide metrics shared by the limiter, pipeline and sinks
+metrics = Metrics()
+
+def rpc_name(func, args):
+    """Metric label for a call: the request type, or the client method name"""
+    if args and hasattr(args[0], 'CONSTRUCTOR_ID'):
+        return type(args[0]).__name__
+    return getattr(func, '__name__', type(func).__name__)
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every RPC the scraper makes.
+    The refill rate creeps up while calls succeed, is halved on every
+    FloodWait and the whole bucket is paused for exactly the number of
+    seconds Telegram asked for before the failed call is retried.
+    """
+    def __init__(self, rate=1.0, min_rate=0.2, max_rate=5.0, burst=3, increase=0.05, backoff=0.5, max_retries=5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.backoff = backoff
+        self.max_retries = max_retries
+        
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+        
+        # Counters for progress output
+        self.calls = 0
+        self.flood_waits = 0
+        self.retries = 0
+        self.wait_time = 0.0
+    
+    async def acquire(self):
+        """Wait until a token is available (and any flood wait is over)"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                paused = now < self.paused_until
+                if paused:
+                    delay = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+                
+                self.wait_time += delay
+                metrics.inc('flood_wait_seconds' if paused else 'rate_limit_wait', delay)
+                await asyncio.sleep(delay)
+    
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+    
+    def on_flood_wait(self, seconds):
+        self.flood_waits += 1
+        self.rate = max(self.min_rate, self.rate * self.backoff)
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.paused_until = max(self.paused_until, self.updated + seconds)
+    
+    async def call(self, func, *args, max_flood_wait=None, **kwargs):
+        """
+        Run one API call under the limiter, retrying it after FloodWait
+        and transient server/connection errors. A FloodWait longer than
+        max_flood_wait is raised (after pausing the bucket) so the caller
+        can move the call elsewhere.
+        """
+        method = rpc_name(func, args)
+        attempt = 0
+        while True:
+            await self.acquire()
+            self.calls += 1
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                metrics.observe('rpc', time.perf_counter() - started, method=method)
+                metrics.inc('flood_waits', method=method)
+                attempt += 1
+                self.on_flood_wait(e.seconds)
+                if attempt > self.max_retries:
+                    raise
+                if max_flood_wait is not None and e.seconds > max_flood_wait:
+                    raise
+                print(f"⏳ FloodWait: pausing {e.seconds}s, rate lowered to {self.rate:.2f} req/s (retry {attempt}/{self.max_retries})")
+                self.retries += 1
+                continue
+            except (ServerError, RpcCallFailError, ConnectionError, asyncio.TimeoutError) as e:
+                metrics.observe('rpc', time.perf_counter() - started, method=method)
+                metrics.inc('rpc_errors', method=method, error=type(e).__name__)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                self.rate = max(self.min_rate, self.rate * self.backoff)
+                print(f"⚠️  Transient error ({e}), retrying in {delay}s (retry {attempt}/{self.max_retries})")
+                self.retries += 1
+                self.wait_time += delay
+                metrics.inc('backoff_seconds', delay)
+                await asyncio.sleep(delay)
+                continue
+            except Exception as e:
+                metrics.observe('rpc', time.perf_counter() - started, method=method)
+                metrics.inc('rpc_errors', method=method, error=type(e).__name__)
+                raise
+            
+            metrics.observe('rpc', time.perf_counter() - started, method=method)
+            self.on_success()
+            return result
+    
+    def stats(self):
+        """One line summary of the limiter state"""
+        return (f"{self.rate:.2f} req/s, {self.calls} calls, {self.flood_waits} flood waits, "
+                f"{self.retries} retries, {self.wait_time:.1f}s waited")
+
+# Label of the group a task is scraping, used for fair scheduling and progress output
+current_group = contextvars.ContextVar('current_group', default=None)
+
+def group_prefix():
+    """Prefix progress lines with the group being scraped in multi-group runs"""
+    label = current_group.get()
+    return f"[{label}] " if label else ""
+
+def log_event(event, level=logging.DEBUG, **fields):
+    """
+    Log one progress event as a JSON line tagged with the current group.
+    Nothing is formatted unless the logger is enabled for `level`.
+    """
+    if not log.isEnabledFor(level):
+        return
+    record = {'ts': round(time.time(), 3), 'event': event}
+    label = current_group.get()
+    if label:
+        record['group'] = label
+    record.update(fields)
+    log.log(level, json.dumps(record, default=str))
+
+# Set while a task's call holds a scheduler slot
+holding_slot = contextvars.ContextVar('holding_slot', default=False)
+
+class RequestScheduler:
+    """
+    Global scheduler in front of the rate limiter (or account pool).
+    Caps the number of RPCs in flight and hands free slots to waiting
+    groups round-robin, so every group gets an equal share of the request
+    budget no matter how many requests it queues. Calls made from inside
+    a call that already holds a slot (an account failover resolving the
+    group on another account) reuse that slot, so flooded requests holding
+    every slot cannot deadlock waiting for a second one.
+    """
+    def __init__(self, limiter, max_in_flight=4):
+        self.limiter = limiter
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.waiting = {}
+        self.order = deque()
+        self.granted = {}
+    
+    async def _enter(self, group):
+        if self.in_flight < self.max_in_flight and not self.order:
+            self.in_flight += 1
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        if group not in self.waiting:
+            self.waiting[group] = deque()
+            self.order.append(group)
+        self.waiting[group].append(future)
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been granted just before the cancellation
+            if future.done() and not future.cancelled():
+                self._leave()
+            raise
+    
+    def _leave(self):
+        self.in_flight -= 1
+        self._dispatch()
+    
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight and self.order:
+            group = self.order.popleft()
+            queue = self.waiting[group]
+            future = queue.popleft()
+            if queue:
+                self.order.append(group)
+            else:
+                del self.waiting[group]
+            
+            if future.cancelled():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+    
+    async def call(self, func, *args, **kwargs):
+        """Run one API call once the calling group gets a slot"""
+        if holding_slot.get():
+            return await self.limiter.call(func, *args, **kwargs)
+        
+        group = current_group.get()
+        await self._enter(group)
+        token = holding_slot.set(True)
+        try:
+            self.granted[group] = self.granted.get(group, 0) + 1
+            return await self.limiter.call(func, *args, **kwargs)
+        finally:
+            holding_slot.reset(token)
+            self._leave()
+
+# Account a task is running on; unset means the pool's primary account
+current_account = contextvars.ContextVar('current_account', default=None)
+
+class Account:
+    """
+    One Telegram login: its client, its own rate limiter and the group
+    peers it has resolved (access hashes differ between accounts)
+    """
+    def __init__(self, name, api_id, api_hash, phone_number, session):
+        self.name = name
+        self.phone_number = phone_number
+        # FloodWaits are handled by the limiter instead of Telethon's silent sleep
+        self.client = TelegramClient(session, api_id, api_hash, flood_sleep_threshold=0)
+        self.limiter = AdaptiveRateLimiter()
+        self.peers = {}
+        self.groups = 0
+        self.dialogs = DialogIndex(f"{session}_dialogs.json")
+    
+    def sidelined(self):
+        """True while the account is sitting out a FloodWait"""
+        return time.monotonic() < self.limiter.paused_until
+
+class ClientPool:
+    """
+    Accounts the scraper spreads its work over.
+    Every task runs on the account stored in current_account (the first
+    account by default). A history request that hits a FloodWait longer
+    than failover_after seconds is moved to another account that can see
+    the same group, while the flooded account sits out its wait.
+    """
+    def __init__(self, accounts, failover_after=10):
+        self.accounts = accounts
+        self.primary = accounts[0]
+        self.failover_after = failover_after
+        self.failovers = 0
+        # Set by the scraper: async (account, peer_id) -> input peer or None
+        self.resolve_peer = None
+    
+    def current(self):
+        return current_account.get() or self.primary
+    
+    def assign(self):
+        """Pick the least busy account for a new group task"""
+        account = min(self.accounts, key=lambda a: (a.sidelined(), a.groups))
+        account.groups += 1
+        return account
+    
+    def remember(self, account, entity):
+        """Record the input peer an account uses for a group"""
+        account.peers[utils.get_peer_id(entity)] = utils.get_input_peer(entity)
+    
+    async def peer_for(self, account, peer_id):
+        """Input peer for a group on a given account, resolved on first use"""
+        if peer_id not in account.peers:
+            input_peer = None
+            if self.resolve_peer:
+                try:
+                    input_peer = await self.resolve_peer(account, peer_id)
+                except Exception as e:
+                    print(f"{group_prefix()}⚠️  {account.name} cannot access group {peer_id}: {e}")
+            account.peers[peer_id] = input_peer
+        return account.peers[peer_id]
+    
+    async def call(self, func, *args, **kwargs):
+        """Run one API call on the current account, failing history requests over"""
+        account = self.current()
+        request = args[0] if args and isinstance(args[0], GetHistoryRequest) else None
+        if request is None or len(self.accounts) == 1:
+            return await account.limiter.call(func, *args, **kwargs)
+        
+        peer_id = utils.get_peer_id(request.peer)
+        while True:
+            # Requests are built with the entity of the account that resolved
+            # the group; after a failover they need this account's access hash
+            input_peer = await self.peer_for(account, peer_id)
+            if input_peer is not None and input_peer is not request.peer:
+                request = copy.copy(request)
+                request.peer = input_peer
+            try:
+                return await account.limiter.call(account.client, request,
+                                                  max_flood_wait=self.failover_after)
+            except FloodWaitError:
+                pass
+            
+            for other in sorted(self.accounts, key=lambda a: a.limiter.paused_until):
+                if other is account or other.sidelined():
+                    continue
+                input_peer = await self.peer_for(other, peer_id)
+                if input_peer:
+                    print(f"{group_prefix()}🔀 {account.name} sidelined by FloodWait, continuing on {other.name}")
+                    account = other
+                    current_account.set(other)
+                    self.failovers += 1
+                    metrics.inc('failovers')
+                    break
+            else:
+                # Nobody else can take over, wait the flood out here
+                return await account.limiter.call(account.client, request)
+    
+    async def disconnect(self):
+        for account in self.accounts:
+            await account.client.disconnect()
+    
+    def stats(self):
+        """Per-account limiter summaries"""
+        return [f"{account.name}: {account.limiter.stats()}" for account in self.accounts]
+
+def load_accounts(api_id, api_hash, phone_number):
+    """
+    Build the account list: the primary credentials plus any extra sets
+    named TELEGRAM_API_ID_2 / TELEGRAM_API_HASH_2 / TELEGRAM_PHONE_NUMBER_2,
+    _3 and so on, each with its own session file
+    """
+    accounts = [Account('account 1', api_id, api_hash, phone_number, 'session')]
+    
+    index = 2
+    while os.getenv(f'TELEGRAM_API_ID_{index}'):
+        extra_id = os.getenv(f'TELEGRAM_API_ID_{index}')
+        extra_hash = os.getenv(f'TELEGRAM_API_HASH_{index}')
+        extra_phone = os.getenv(f'TELEGRAM_PHONE_NUMBER_{index}')
+        
+        if not all([extra_hash, extra_phone]):
+            raise ValueError(f"Account {index} needs TELEGRAM_API_ID_{index}, TELEGRAM_API_HASH_{index} and TELEGRAM_PHONE_NUMBER_{index}")
+        try:
+            extra_id = int(extra_id)
+        except ValueError:
+            raise ValueError(f"TELEGRAM_API_ID_{index} must be a number")
+        
+        accounts.append(Account(f'account {index}', extra_id, extra_hash, extra_phone, f'session_{index}'))
+        index += 1
+    
+    return accounts
+
+class SenderResolver:
+    """
+    Per-run cache of sender display names keyed by peer id.
+    Filled from the users/chats that come back with every history page,
+    so most messages never need a separate entity lookup.
+    """
+    def __init__(self, pool, scheduler):
+        self.pool = pool
+        self.scheduler = scheduler
+        self.names = {}
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def format_sender(sender):
+        """Build the display name used in exports for a sender entity"""
+        sender_info = "Unknown"
+        if hasattr(sender, 'username') and sender.username:
+            sender_info = f"@{sender.username}"
+        elif hasattr(sender, 'first_name'):
+            sender_info = sender.first_name
+            if hasattr(sender, 'last_name') and sender.last_name:
+                sender_info += f" {sender.last_name}"
+        return sender_info
+    
+    def ingest(self, users=(), chats=()):
+        """Cache every user and chat returned alongside a history page"""
+        for entity in list(users) + list(chats):
+            try:
+                self.names[utils.get_peer_id(entity)] = self.format_sender(entity)
+            except TypeError:
+                continue
+    
+    async def prefetch(self, sender_ids):
+        """
+        Resolve every sender id not seen so far with one batched lookup
+        """
+        unknown = list({pid for pid in sender_ids if pid and pid not in self.names})
+        if not unknown:
+            return
+        
+        self.misses += len(unknown)
+        metrics.inc('sender_lookups', len(unknown))
+        try:
+            entities = await self.scheduler.call(self.pool.current().client.get_entity, unknown)
+            for pid, entity in zip(unknown, entities):
+                self.names[pid] = self.format_sender(entity)
+        except Exception:
+            for pid in unknown:
+                self.names[pid] = f"ID: {pid}"
+    
+    def lookup(self, sender_id):
+        """Cached display name for a sender id, or None on a miss"""
+        name = self.names.get(sender_id)
+        if name is not None:
+            self.hits += 1
+        return name
+    
+    async def resolve(self, sender_id):
+        """Return the display name for a sender id, fetching it only on a miss"""
+        if sender_id in self.names:
+            self.hits += 1
+            return self.names[sender_id]
+        
+        await self.prefetch([sender_id])
+        return self.names[sender_id]
+
+MESSAGE_FIELDS = ['id', 'date', 'sender', 'text', 'media_type', 'media_info', 'reply_to', 'views', 'forwards', 'is_reply',
+                  'media_path', 'cluster_id', 'thread_id', 'depth', 'lang', 'airdrop_score']
+
+# Media type names are stored on records as small integer codes
+MEDIA_TYPE_NAMES = [None, 'MessageMediaPhoto', 'MessageMediaDocument', 'MessageMediaWebPage',
+                    'MessageMediaPoll', 'MessageMediaGeo', 'MessageMediaContact']
+MEDIA_TYPE_CODES = {name: code for code, name in enumerate(MEDIA_TYPE_NAMES)}
+
+def media_type_code(media):
+    """Integer code for a media class name, registering unseen types"""
+    if media is None:
+        return 0
+    name = type(media).__name__
+    code = MEDIA_TYPE_CODES.get(name)
+    if code is None:
+        code = MEDIA_TYPE_CODES[name] = len(MEDIA_TYPE_NAMES)
+        MEDIA_TYPE_NAMES.append(name)
+    return code
+
+def format_date(epoch):
+    """Export format for a record's epoch timestamp (UTC)"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch))
+
+class MessageRecord:
+    """
+    Compact extracted message.
+    Dates are kept as epoch ints, senders as an id plus the resolver's
+    shared display string and media types as integer codes; strings are
+    only formatted at the export boundary by as_dict(). Indexing with a
+    field name still works for code that expects the old dicts.
+    """
+    __slots__ = ('id', 'date', 'sender_id', 'sender', 'text', 'media_code', 'media_info',
+                 'reply_to', 'views', 'forwards', 'is_reply', 'media_path', 'cluster_id', 'thread_id', 'depth',
+                 'lang', 'airdrop_score')
+    
+    def __init__(self, id, date, sender_id, sender, text, media_code, media_info,
+                 reply_to, views, forwards, is_reply, media_path=None, cluster_id=None,
+                 thread_id=None, depth=None, lang=None, airdrop_score=None):
+        self.id = id
+        self.date = date
+        self.sender_id = sender_id
+        self.sender = sender
+        self.text = text
+        self.media_code = media_code
+        self.media_info = media_info
+        self.reply_to = reply_to
+        self.views = views
+        self.forwards = forwards
+        self.is_reply = is_reply
+        self.media_path = media_path
+        self.cluster_id = cluster_id
+        self.thread_id = thread_id
+        self.depth = depth
+        self.lang = lang
+        self.airdrop_score = airdrop_score
+    
+    @classmethod
+    def from_message(cls, message, sender_info):
+        """Build a record from a Telethon message and its resolved sender name"""
+        media = message.media
+        media_info = ""
+        if media is not None:
+            document = getattr(media, 'document', None)
+            mime_type = getattr(document, 'mime_type', None)
+            if mime_type:
+                media_info = sys.intern(mime_type)
+        
+        reply_to = message.reply_to
+        return cls(
+            message.id,
+            int(message.date.timestamp()),
+            message.sender_id,
+            sender_info,
+            message.text or "",
+            media_type_code(media),
+            media_info,
+            reply_to.reply_to_msg_id if reply_to else None,
+            getattr(message, 'views', None),
+            getattr(message, 'forwards', None),
+            reply_to is not None
+        )
+    
+    @property
+    def media_type(self):
+        return MEDIA_TYPE_NAMES[self.media_code]
+    
+    @property
+    def date_text(self):
+        return format_date(self.date)
+    
+    def as_dict(self):
+        """Export row with the same fields and formatting as before"""
+        return {
+            'id': self.id,
+            'date': format_date(self.date),
+            'sender': self.sender,
+            'text': self.text,
+            'media_type': MEDIA_TYPE_NAMES[self.media_code],
+            'media_info': self.media_info,
+            'reply_to': self.reply_to,
+            'views': self.views,
+            'forwards': self.forwards,
+            'is_reply': self.is_reply,
+            'media_path': self.media_path,
+            'cluster_id': self.cluster_id,
+            'thread_id': self.thread_id,
+            'depth': self.depth,
+            'lang': self.lang,
+            'airdrop_score': self.airdrop_score
+        }
+    
+    def __getitem__(self, field):
+        if field == 'date':
+            return self.date_text
+        if field == 'media_type':
+            return self.media_type
+        if field in MESSAGE_FIELDS:
+            return getattr(self, field)
+        raise KeyError(field)
+
+def export_row(message):
+    """Export dict for a record (plain dicts pass through unchanged)"""
+    return message.as_dict() if isinstance(message, MessageRecord) else message
+
+def as_utc(date):
+    """Treat naive datetimes as UTC so they compare with Telegram's dates"""
+    return date.replace(tzinfo=timezone.utc) if date.tzinfo is None else date
+
+def message_window(since=None, until=None, months_back=6):
+    """
+    UTC (start, end) of a scrape: from `since` (default: months_back
+    before `until`, or before now) up to `until` (default: now)
+    """
+    end = as_utc(until) if until else datetime.now(timezone.utc)
+    start = as_utc(since) if since else end - timedelta(days=months_back * 30)
+    if start >= end:
+        raise ValueError(f"--since ({start.strftime('%Y-%m-%d')}) must be before --until ({end.strftime('%Y-%m-%d')})")
+    return start, end
+
+def describe_window(since, until, months_back=6):
+    """Human readable since/until window for progress output"""
+    if until and not since:
+        since, _ = message_window(since, until, months_back)
+    start = since.strftime('%Y-%m-%d') if since else 'beginning'
+    end = until.strftime('%Y-%m-%d') if until else 'now'
+    return f"{start} to {end}"
+
+def parse_date(value):
+    """argparse type for YYYY-MM-DD dates, interpreted as UTC midnight"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', expected YYYY-MM-DD")
+
+# File name suffix for each streaming compression option
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+class MessageSink:
+    """
+    Base class for streaming exports.
+    The file is opened on the first batch and flushed after every batch,
+    so rows land on disk while the scrape is still running. Output can be
+    gzip or zstd compressed as it streams, and rotated into numbered chunk
+    files once a chunk reaches max_bytes on disk or max_rows rows; rotated
+    exports keep a manifest listing every chunk with its id and date range.
+    """
+    label = 'Output'
+    extension = ''
+    
+    def __init__(self, filename, compression=None, max_bytes=None, max_rows=None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression '{compression}'. Choose from: gzip, zstd")
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.rotating = bool(max_bytes or max_rows)
+        self.stem = filename[:-len(self.extension)] if self.extension and filename.endswith(self.extension) else filename
+        if self.rotating:
+            self.filename = f"{self.stem}{self.extension}.manifest.json"
+        else:
+            self.filename = filename + COMPRESSION_SUFFIXES[compression]
+        self.file = None
+        self.raw = None
+        self.count = 0
+        self.file_rows = 0
+        self.chunks = []
+    
+    def open(self):
+        if self.rotating:
+            path = f"{self.stem}.{len(self.chunks) + 1:05d}{self.extension}{COMPRESSION_SUFFIXES[self.compression]}"
+        else:
+            path = self.filename
+        
+        self.raw = open(path, 'wb')
+        if self.compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError("zstd compression needs zstandard. Please run: pip install zstandard")
+            stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            stream = self.raw
+        self.file = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        self.file_rows = 0
+        self.chunks.append({'file': os.path.basename(path), 'path': path, 'rows': 0, 'bytes': 0,
+                            'min_id': None, 'max_id': None, 'min_date': None, 'max_date': None})
+    
+    def write_batch(self, messages):
+        """Append a batch of message records (or dicts) to the file"""
+        if not messages:
+            return
+        if self.file is None:
+            self.open()
+            self.write_header()
+        self.write_rows(messages)
+        self.file.flush()
+        self.count += len(messages)
+        self.file_rows += len(messages)
+        if self.rotating:
+            self.track(messages)
+        
+        if self.rotating and ((self.max_rows and self.file_rows >= self.max_rows) or
+                              (self.max_bytes and self.raw.tell() >= self.max_bytes)):
+            self.close_file()
+    
+    def track(self, messages):
+        """
+        Extend the current chunk's row count and id/date ranges. Records
+        are tracked by their epoch dates, formatted once when the chunk closes.
+        """
+        chunk = self.chunks[-1]
+        if isinstance(messages[0], MessageRecord):
+            ids = [m.id for m in messages]
+            dates = [m.date for m in messages]
+        else:
+            ids = [m['id'] for m in messages]
+            dates = [m['date'] for m in messages]
+        chunk['rows'] += len(messages)
+        chunk['min_id'] = min(ids) if chunk['min_id'] is None else min(chunk['min_id'], *ids)
+        chunk['max_id'] = max(ids) if chunk['max_id'] is None else max(chunk['max_id'], *ids)
+        chunk['min_date'] = min(dates) if chunk['min_date'] is None else min(chunk['min_date'], *dates)
+        chunk['max_date'] = max(dates) if chunk['max_date'] is None else max(chunk['max_date'], *dates)
+    
+    def write_header(self):
+        pass
+    
+    def write_rows(self, messages):
+        raise NotImplementedError
+    
+    def update_threads(self, fixups, subtrees=None):
+        """Fix thread ids of rows already written; flat files keep what they wrote"""
+        pass
+    
+    def write_footer(self):
+        pass
+    
+    def close_file(self):
+        """Finish the current file (and its compressed stream)"""
+        if self.file is None:
+            return
+        self.write_footer()
+        self.file.close()
+        self.raw.close()
+        self.file = None
+        chunk = self.chunks[-1]
+        chunk['bytes'] = os.path.getsize(chunk['path'])
+        if self.rotating:
+            for key in ('min_date', 'max_date'):
+                if isinstance(chunk[key], int):
+                    chunk[key] = format_date(chunk[key])
+            self.write_manifest()
+    
+    def write_manifest(self):
+        """List the finished chunks so readers can pick the ones they need"""
+        manifest = {
+            'format': self.label,
+            'compression': self.compression,
+            'rows': sum(chunk['rows'] for chunk in self.chunks),
+            'chunks': [{k: v for k, v in chunk.items() if k != 'path'} for chunk in self.chunks],
+        }
+        tmp_path = f"{self.filename}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.filename)
+    
+    def disk_size(self):
+        """Bytes written to disk across every file of the export"""
+        if self.chunks:
+            return sum(chunk['bytes'] for chunk in self.chunks)
+        return os.path.getsize(self.filename)
+    
+    def close(self):
+        self.close_file()
+
+class CsvSink(MessageSink):
+    """CSV export with one row per message"""
+    label = 'CSV'
+    extension = '.csv'
+    
+    def write_header(self):
+        self.writer = csv.DictWriter(self.file, fieldnames=MESSAGE_FIELDS)
+        self.writer.writeheader()
+    
+    def write_rows(self, messages):
+        self.writer.writerows(export_row(m) for m in messages)
+
+class JsonLinesSink(MessageSink):
+    """JSON Lines export with one object per line"""
+    label = 'JSON Lines'
+    extension = '.jsonl'
+    
+    def write_rows(self, messages):
+        self.file.write(''.join(json.dumps(export_row(m), ensure_ascii=False) + '\n' for m in messages))
+
+class JsonArraySink(MessageSink):
+    """Valid JSON array written incrementally, one message per line"""
+    label = 'JSON'
+    extension = '.json'
+    
+    def write_header(self):
+        self.file.write('[\n')
+    
+    def write_rows(self, messages):
+        separator = ',\n' if self.file_rows else ''
+        self.file.write(separator + ',\n'.join(json.dumps(export_row(m), ensure_ascii=False) for m in messages))
+    
+    def write_footer(self):
+        self.file.write('\n]\n')
+
+class MessageArchive:
+    """
+    Local SQLite archive of scraped messages.
+    Messages are upserted on (group_id, id) so repeat scrapes never
+    duplicate rows; WAL mode keeps readers unblocked while a scrape writes.
+    Indexed for time ranges, senders and reply lookups, with an FTS5
+    index over the text.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS groups (
+            group_id INTEGER PRIMARY KEY,
+            title TEXT
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            group_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            date INTEGER NOT NULL,
+            sender_id INTEGER,
+            sender TEXT,
+            text TEXT,
+            media_type TEXT,
+            media_info TEXT,
+            reply_to INTEGER,
+            views INTEGER,
+            forwards INTEGER,
+            is_reply INTEGER,
+            media_path TEXT,
+            cluster_id INTEGER,
+            thread_id INTEGER,
+            depth INTEGER,
+            lang TEXT,
+            airdrop_score INTEGER,
+            PRIMARY KEY (group_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_group_date ON messages (group_id, date);
+        CREATE INDEX IF NOT EXISTS idx_messages_group_sender ON messages (group_id, sender_id);
+        CREATE INDEX IF NOT EXISTS idx_messages_reply_to ON messages (group_id, reply_to);
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+            text, content='messages', content_rowid='rowid'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF text ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+            INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+        END;
+    """
+    
+    # Columns added after the first schema, created on older archives when opened
+    ADDED_COLUMNS = [('media_path', 'TEXT'), ('cluster_id', 'INTEGER'), ('thread_id', 'INTEGER'), ('depth', 'INTEGER'),
+                     ('lang', 'TEXT'), ('airdrop_score', 'INTEGER')]
+    
+    # Indexes over added columns, created once the columns exist
+    ADDED_INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (group_id, thread_id, date);
+    """
+    
+    UPSERT = """
+        INSERT INTO messages (group_id, id, date, sender_id, sender, text, media_type,
+                              media_info, reply_to, views, forwards, is_reply, media_path, cluster_id,
+                              thread_id, depth, lang, airdrop_score)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (group_id, id) DO UPDATE SET
+            date = excluded.date, sender_id = excluded.sender_id, sender = excluded.sender,
+            text = excluded.text, media_type = excluded.media_type, media_info = excluded.media_info,
+            reply_to = excluded.reply_to, views = excluded.views, forwards = excluded.forwards,
+            is_reply = excluded.is_reply, media_path = COALESCE(excluded.media_path, media_path),
+            cluster_id = COALESCE(excluded.cluster_id, cluster_id),
+            thread_id = COALESCE(excluded.thread_id, thread_id), depth = COALESCE(excluded.depth, depth),
+            lang = COALESCE(excluded.lang, lang), airdrop_score = COALESCE(excluded.airdrop_score, airdrop_score)
+    """
+    
+    def __init__(self, path='telegram_archive.db'):
+        # Only runs that write the archive pay for the sqlite3 import
+        import sqlite3
+        
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        for column, column_type in self.ADDED_COLUMNS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {column_type}")
+        self.conn.executescript(self.ADDED_INDEXES)
+    
+    def add_group(self, group_id, title):
+        with self.conn:
+            self.conn.execute("INSERT INTO groups (group_id, title) VALUES (?, ?) "
+                              "ON CONFLICT (group_id) DO UPDATE SET title = excluded.title",
+                              (group_id, title))
+    
+    def upsert(self, group_id, records):
+        """Write one fetched page of records in a single transaction"""
+        with self.conn:
+            self.conn.executemany(self.UPSERT, (
+                (group_id, r.id, r.date, r.sender_id, r.sender, r.text, r.media_type,
+                 r.media_info, r.reply_to, r.views, r.forwards, int(r.is_reply), r.media_path, r.cluster_id,
+                 r.thread_id, r.depth, r.lang, r.airdrop_score)
+                for r in records
+            ))
+    
+    def update_threads(self, group_id, fixups, subtrees=None):
+        """
+        Move already archived messages to the thread a late parent revealed:
+        single rows from `fixups`, and whole subtrees archived by earlier
+        runs under a placeholder root from `subtrees`
+        """
+        with self.conn:
+            if subtrees:
+                self.conn.executemany(
+                    "UPDATE messages SET thread_id = ?, depth = depth + ? WHERE group_id = ? AND thread_id = ?",
+                    ((thread_id, depth, group_id, root) for root, (thread_id, depth) in subtrees.items())
+                )
+            self.conn.executemany(
+                "UPDATE messages SET thread_id = ?, depth = ? WHERE group_id = ? AND id = ?",
+                ((thread_id, depth, group_id, message_id) for message_id, (thread_id, depth) in fixups.items())
+            )
+    
+    def clear_media_paths(self, paths):
+        """Forget media paths whose download failed; the next run fetches them again"""
+        with self.conn:
+            self.conn.executemany("UPDATE messages SET media_path = NULL WHERE media_path = ?",
+                                  ((path,) for path in paths))
+    
+    def thread_position(self, group_id, message_id):
+        """(thread_id, depth) of an archived message, or None"""
+        return self.conn.execute("SELECT thread_id, depth FROM messages WHERE group_id = ? AND id = ?",
+                                 (group_id, message_id)).fetchone()
+    
+    def thread(self, group_id, thread_id):
+        """Every archived message of one thread, oldest first"""
+        return self.conn.execute(
+            "SELECT * FROM messages WHERE group_id = ? AND thread_id = ? ORDER BY date, id",
+            (group_id, thread_id)
+        ).fetchall()
+    
+    def messages_by_sender(self, group_id, sender_id, since=None, until=None):
+        """Messages from one sender, optionally limited to a date range"""
+        return self.conn.execute(
+            "SELECT * FROM messages WHERE group_id = ? AND sender_id = ? AND date >= ? AND date < ? ORDER BY date",
+            (group_id, sender_id, int(as_utc(since).timestamp()) if since else 0,
+             int(as_utc(until).timestamp()) if until else 2 ** 62)
+        ).fetchall()
+    
+    def search(self, query, group_id=None, limit=100):
+        """Full-text search over message text, best matches first"""
+        sql = ("SELECT m.* FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+               "WHERE messages_fts MATCH ?")
+        params = [query]
+        if group_id is not None:
+            sql += " AND m.group_id = ?"
+            params.append(group_id)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+    
+    def close(self):
+        self.conn.close()
+
+class SqliteSink(MessageSink):
+    """Upserts every batch into the shared SQLite archive"""
+    label = 'SQLite archive'
+    extension = '.db'
+    
+    def __init__(self, filename, group_entity):
+        super().__init__(filename)
+        self.group_id = utils.get_peer_id(group_entity)
+        self.group_title = getattr(group_entity, 'title', None)
+        self.archive = None
+    
+    def write_batch(self, messages):
+        if not messages:
+            return
+        if self.archive is None:
+            self.archive = MessageArchive(self.filename)
+            self.archive.add_group(self.group_id, self.group_title)
+        self.archive.upsert(self.group_id, messages)
+        self.count += len(messages)
+    
+    def update_threads(self, fixups, subtrees=None):
+        if self.archive is not None and (fixups or subtrees):
+            self.archive.update_threads(self.group_id, fixups, subtrees)
+    
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+class ParquetSink(MessageSink):
+    """
+    Columnar Parquet export (needs pyarrow).
+    Batches are buffered into row groups of row_group_size rows and
+    written as they fill; sender, media type and mime type columns are
+    dictionary encoded and pages are zstd compressed.
+    """
+    label = 'Parquet'
+    extension = '.parquet'
+    
+    def __init__(self, filename, row_group_size=10_000, compression='zstd'):
+        super().__init__(filename)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("The parquet output format needs pyarrow. Please run: pip install pyarrow")
+        
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.writer = None
+        self.pending = []
+        
+        dictionary = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        self.schema = pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('date', pyarrow.timestamp('s', tz='UTC')),
+            ('sender_id', pyarrow.int64()),
+            ('sender', dictionary),
+            ('text', pyarrow.string()),
+            ('media_type', dictionary),
+            ('media_info', dictionary),
+            ('reply_to', pyarrow.int64()),
+            ('views', pyarrow.int64()),
+            ('forwards', pyarrow.int64()),
+            ('is_reply', pyarrow.bool_()),
+            ('media_path', pyarrow.string()),
+            ('cluster_id', pyarrow.int64()),
+            ('thread_id', pyarrow.int64()),
+            ('depth', pyarrow.int32()),
+            ('lang', dictionary),
+            ('airdrop_score', pyarrow.int32()),
+        ])
+    
+    def write_batch(self, messages):
+        if not messages:
+            return
+        self.pending.extend(messages)
+        self.count += len(messages)
+        if len(self.pending) >= self.row_group_size:
+            self.flush()
+    
+    def flush(self):
+        """Write buffered records as one row group"""
+        if not self.pending:
+            return
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(
+                self.filename, self.schema, compression=self.compression,
+                use_dictionary=['sender', 'media_type', 'media_info', 'lang']
+            )
+        
+        pa = self.pa
+        records = self.pending
+        self.pending = []
+        columns = [
+            pa.array([r.id for r in records], pa.int64()),
+            pa.array([r.date for r in records], pa.timestamp('s', tz='UTC')),
+            pa.array([r.sender_id for r in records], pa.int64()),
+            pa.array([r.sender for r in records], pa.string()).dictionary_encode(),
+            pa.array([r.text for r in records], pa.string()),
+            pa.array([r.media_type for r in records], pa.string()).dictionary_encode(),
+            pa.array([r.media_info for r in records], pa.string()).dictionary_encode(),
+            pa.array([r.reply_to for r in records], pa.int64()),
+            pa.array([r.views for r in records], pa.int64()),
+            pa.array([r.forwards for r in records], pa.int64()),
+            pa.array([r.is_reply for r in records], pa.bool_()),
+            pa.array([r.media_path for r in records], pa.string()),
+            pa.array([r.cluster_id for r in records], pa.int64()),
+            pa.array([r.thread_id for r in records], pa.int64()),
+            pa.array([r.depth for r in records], pa.int32()),
+            pa.array([r.lang for r in records], pa.string()).dictionary_encode(),
+            pa.array([r.airdrop_score for r in records], pa.int32()),
+        ]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+    
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+SINK_FORMATS = {
+    'csv': CsvSink,
+    'json': JsonArraySink,
+    'jsonl': JsonLinesSink,
+    'sqlite': SqliteSink,
+    'parquet': ParquetSink,
+}
+
+class MediaDownloader:
+    """
+    Optional media stage: photos and documents are downloaded by a small
+    worker pool in the background, so the text scrape never waits on them.
+    Files are named by photo/document id, so forwarded copies of the same
+    file are fetched once, and the path is known (and exported) before the
+    download finishes. Unfinished downloads stay as .part files and resume
+    from where they stopped on the next run. A FloodWait pauses the
+    account's rate limiter and the download resumes from its .part file
+    once the wait is over; paths of downloads that still failed are kept
+    in failed_paths so they are not exported. Total download speed can be
+    capped in bytes per second.
+    """
+    def __init__(self, directory='media', workers=3, max_bytes_per_second=None, chunk_size=128 * 1024):
+        self.directory = directory
+        self.worker_count = workers
+        self.max_bytes_per_second = max_bytes_per_second
+        self.chunk_size = chunk_size
+        self.queue = None
+        self.workers = []
+        self.seen = set()
+        self.allowance = 0
+        self.last_refill = time.monotonic()
+        self.downloaded = 0
+        self.reused = 0
+        self.failed = 0
+        self.failed_paths = set()
+        self.bytes = 0
+    
+    def locate(self, media):
+        """The downloadable photo/document of a message's media and its content-addressed path"""
+        if isinstance(media, MessageMediaPhoto) and media.photo:
+            return media.photo, os.path.join(self.directory, f"photo_{media.photo.id}.jpg")
+        if isinstance(media, MessageMediaDocument) and media.document:
+            extension = utils.get_extension(media.document) or ''
+            return media.document, os.path.join(self.directory, f"document_{media.document.id}{extension}")
+        return None, None
+    
+    def submit(self, account, media):
+        """Queue a download on an account if the file is new and return its path right away"""
+        location, path = self.locate(media)
+        if path is None:
+            return None
+        if path in self.seen or os.path.exists(path):
+            self.reused += 1
+            self.seen.add(path)
+            return path
+        
+        self.seen.add(path)
+        self.failed_paths.discard(path)
+        if self.queue is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.queue = asyncio.Queue()
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        self.queue.put_nowait((account, location, path))
+        return path
+    
+    async def _worker(self):
+        while True:
+            account, location, path = await self.queue.get()
+            try:
+                with metrics.timer('stage', stage='media'):
+                    await self._download(account, location, path)
+                self.downloaded += 1
+            except Exception as e:
+                self.failed += 1
+                # Forget the path so a later copy of the file is tried again
+                self.seen.discard(path)
+                self.failed_paths.add(path)
+                metrics.inc('media_failures')
+                print(f"{group_prefix()}⚠️  Media download failed for {path}: {e}")
+            finally:
+                self.queue.task_done()
+    
+    async def _download(self, account, location, path):
+        """
+        Download one file, resuming a previous .part file if present.
+        FloodWaits go through the account's limiter, then the file resumes.
+        """
+        part_path = f"{path}.part"
+        limiter = account.limiter
+        attempt = 0
+        while True:
+            offset = 0
+            if os.path.exists(part_path):
+                # Resume on a chunk boundary, dropping any torn tail
+                offset = os.path.getsize(part_path) // self.chunk_size * self.chunk_size
+            
+            await limiter.acquire()
+            try:
+                with open(part_path, 'ab') as f:
+                    f.truncate(offset)
+                    async for chunk in account.client.iter_download(location, offset=offset, request_size=self.chunk_size):
+                        await self._throttle(len(chunk))
+                        f.write(chunk)
+                        self.bytes += len(chunk)
+                        metrics.inc('media_bytes', len(chunk))
+                break
+            except FloodWaitError as e:
+                attempt += 1
+                metrics.inc('flood_waits', method='GetFileRequest')
+                limiter.on_flood_wait(e.seconds)
+                if attempt > limiter.max_retries:
+                    raise
+                print(f"{group_prefix()}⏳ Media FloodWait: pausing {e.seconds}s, then resuming {path} (retry {attempt}/{limiter.max_retries})")
+        os.replace(part_path, path)
+    
+    async def _throttle(self, size):
+        """Token bucket over bytes shared by all workers"""
+        if not self.max_bytes_per_second:
+            return
+        now = time.monotonic()
+        self.allowance = min(self.max_bytes_per_second,
+                             self.allowance + (now - self.last_refill) * self.max_bytes_per_second)
+        self.last_refill = now
+        self.allowance -= size
+        if self.allowance < 0:
+            metrics.inc('media_throttle_seconds', -self.allowance / self.max_bytes_per_second)
+            await asyncio.sleep(-self.allowance / self.max_bytes_per_second)
+    
+    async def drain(self):
+        """Wait for queued downloads after the text scrape is done"""
+        if self.queue is not None and not self.queue.empty():
+            print(f"🖼️  Waiting for {self.queue.qsize()} queued media downloads...")
+        if self.queue is not None:
+            await self.queue.join()
+        print(f"🖼️  Media: {self.downloaded} downloaded, {self.reused} already stored, "
+              f"{self.failed} failed, {self.bytes} bytes -> {os.path.abspath(self.directory)}")
+    
+    def close(self):
+        """Stop the workers; unfinished files resume next run"""
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+        self.queue = None
+
+# Scripts that identify a language on their own
+SCRIPT_LANGUAGES = [
+    (re.compile(r'[\u0400-\u04ff]'), 'ru'),
+    (re.compile(r'[\u4e00-\u9fff]'), 'zh'),
+    (re.compile(r'[\u3040-\u30ff]'), 'ja'),
+    (re.compile(r'[\uac00-\ud7af]'), 'ko'),
+    (re.compile(r'[\u0600-\u06ff]'), 'ar'),
+    (re.compile(r'[\u0e00-\u0e7f]'), 'th'),
+    (re.compile(r'[\u0900-\u097f]'), 'hi'),
+]
+
+# Frequent function words of Latin-script languages seen in airdrop groups
+LANGUAGE_STOPWORDS = {
+    'en': {'the', 'and', 'to', 'of', 'is', 'for', 'you', 'your', 'this', 'with', 'on', 'are', 'it', 'now'},
+    'id': {'dan', 'yang', 'di', 'ini', 'untuk', 'dengan', 'ke', 'ada', 'bisa', 'tidak', 'sudah', 'aja', 'gan'},
+    'es': {'el', 'la', 'de', 'que', 'y', 'en', 'los', 'para', 'con', 'por', 'una', 'es'},
+    'pt': {'o', 'a', 'de', 'que', 'e', 'do', 'da', 'em', 'para', 'com', 'não', 'uma'},
+    'fr': {'le', 'la', 'les', 'de', 'et', 'des', 'pour', 'est', 'vous', 'une', 'dans'},
+    'de': {'der', 'die', 'und', 'das', 'ist', 'nicht', 'mit', 'für', 'ein', 'sie'},
+    'tr': {'ve', 'bir', 'bu', 'için', 'ile', 'da', 'de', 'çok', 'olan'},
+    'vi': {'và', 'của', 'là', 'có', 'cho', 'các', 'được', 'không', 'với'},
+}
+
+# Weights of words that mark an actionable airdrop post
+AIRDROP_KEYWORDS = {
+    'airdrop': 3, 'retroactive': 3, 'tge': 3, 'claim': 2, 'whitelist': 2, 'snapshot': 2, 'testnet': 2,
+    'galxe': 2, 'zealy': 2, 'faucet': 2, 'mainnet': 1, 'reward': 1, 'rewards': 1, 'points': 1,
+    'quest': 1, 'quests': 1, 'task': 1, 'tasks': 1, 'wallet': 1, 'token': 1, 'mint': 1, 'bridge': 1,
+}
+
+def detect_language(text, tokens):
+    """Best guess language code from script and stopwords, or None"""
+    letters = sum(1 for c in text if c.isalpha())
+    if not letters:
+        return None
+    for pattern, language in SCRIPT_LANGUAGES:
+        if len(pattern.findall(text)) * 3 >= letters:
+            return language
+    
+    votes = {language: sum(1 for t in tokens if t in words) for language, words in LANGUAGE_STOPWORDS.items()}
+    language, count = max(votes.items(), key=lambda item: item[1])
+    return language if count else None
+
+def analyze_texts(texts):
+    """
+    Per-message analytics for one batch: (language, airdrop keyword
+    score) for each text. Runs in worker processes, so it only takes
+    and returns plain tuples.
+    """
+    results = []
+    for text in texts:
+        normalized = re.sub(r'https?://\S+', ' ', text.lower())
+        tokens = re.findall(r'\w+', normalized)
+        results.append((detect_language(normalized, tokens),
+                        sum(AIRDROP_KEYWORDS.get(t, 0) for t in tokens)))
+    return tuple(results)
+
+def batch_features(texts, analyze=True, minhash=None):
+    """
+    All CPU work for one batch, run in a worker process: analyze_texts
+    results (None unless `analyze`) and, when `minhash` carries a
+    DuplicateIndex's (perms, min_tokens), one MinHash signature per text.
+    """
+    results = analyze_texts(texts) if analyze else None
+    signatures = None
+    if minhash is not None:
+        perms, min_tokens = minhash
+        signatures = tuple(minhash_signature(text, perms, min_tokens) for text in texts)
+    return results, signatures
+
+class AnalyticsStage:
+    """
+    Runs the per-batch CPU work (analyze_texts and, with dedup on, MinHash
+    signatures) on a process pool so it never stalls the event loop. Each
+    batch is sent as a tuple of its texts, results come back in submission
+    order, and at most `window` batches are in flight (two per worker by
+    default, enough to keep every core busy). With analyze off the stage
+    only computes signatures.
+    """
+    def __init__(self, workers=None, window=None, analyze=True):
+        self.workers = workers or os.cpu_count() or 1
+        self.window = window or self.workers * 2
+        self.analyze = analyze
+        self.executor = None
+    
+    def submit(self, batch, dedup=None):
+        """Start processing a batch; await the returned future for (results, signatures)"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        texts = tuple(record.text for record in batch)
+        minhash = (dedup.perms, dedup.min_tokens) if dedup is not None else None
+        return asyncio.get_running_loop().run_in_executor(self.executor, batch_features, texts,
+                                                          self.analyze, minhash)
+    
+    @staticmethod
+    def apply(batch, results):
+        for record, (lang, score) in zip(batch, results):
+            record.lang = lang
+            record.airdrop_score = score
+    
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+class LiveBuffer:
+    """
+    Bounded batch of live messages for one group in tail mode.
+    Records go to the group's sinks once max_batch have queued up, or
+    when the periodic flush finds them older than the flush interval.
+    """
+    def __init__(self, sinks, max_batch=100):
+        self.sinks = sinks
+        self.max_batch = max_batch
+        self.records = []
+        self.first_at = None
+        self.total = 0
+    
+    def add(self, record):
+        if not self.records:
+            self.first_at = time.monotonic()
+        self.records.append(record)
+        if len(self.records) >= self.max_batch:
+            self.flush()
+    
+    def due(self, flush_interval):
+        """True when the oldest queued record has waited flush_interval seconds"""
+        return bool(self.records) and time.monotonic() - self.first_at >= flush_interval
+    
+    def flush(self):
+        """Write queued records to every sink, returning how many were written"""
+        if not self.records:
+            return 0
+        batch, self.records = self.records, []
+        with metrics.timer('stage', stage='write'):
+            for sink in self.sinks:
+                sink.write_batch(batch)
+        metrics.inc('rows_written', len(batch))
+        self.total += len(batch)
+        return len(batch)
+    
+    def close(self):
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+
+class CheckpointStore:
+    """
+    Persisted per-group scrape progress, keyed by group id.
+    Records the newest and oldest message ids already archived so re-runs
+    only fetch what is missing. Progress is staged while fetching and
+    committed once the messages are actually saved.
+    """
+    def __init__(self, path='scrape_checkpoints.json'):
+        self.path = path
+        self.groups = {}
+        self.pending = {}
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.groups = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not read checkpoint file {path}: {e}")
+    
+    def get(self, group_id):
+        """Return the committed checkpoint for a group, or None"""
+        return self.groups.get(str(group_id))
+    
+    def needs_backfill(self, group_id, start_date):
+        """Check whether archived history still stops short of start_date"""
+        checkpoint = self.get(group_id)
+        if not checkpoint or checkpoint.get('exhausted'):
+            return False
+        oldest_date = checkpoint.get('oldest_date')
+        if not oldest_date:
+            return True
+        oldest = datetime.strptime(oldest_date, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        return oldest > start_date
+    
+    def stage(self, group_id, **fields):
+        """Record progress that becomes durable on the next commit()"""
+        self.pending.setdefault(str(group_id), {}).update(fields)
+    
+    def snapshot(self, group_id):
+        """Copy of the progress staged so far, to commit once its batch is saved"""
+        return dict(self.pending.get(str(group_id), {}))
+    
+    def discard(self, group_id):
+        """Drop staged progress that never made it to disk"""
+        self.pending.pop(str(group_id), None)
+    
+    def commit(self, group_id, staged=None):
+        """Merge staged progress (or an earlier snapshot of it) and write the store to disk"""
+        if staged is None:
+            staged = self.pending.pop(str(group_id), None)
+        if not staged:
+            return
+        
+        checkpoint = self.groups.setdefault(str(group_id), {'min_id': 0, 'max_id': 0})
+        checkpoint.update(staged)
+        checkpoint['updated_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.groups, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+# Errors meaning a peer can no longer be read with the access hash we hold
+ACCESS_ERRORS = (ChannelPrivateError, ChannelInvalidError, ChatIdInvalidError, PeerIdInvalidError)
+
+class ResolutionCache:
+    """
+    Persisted target -> group lookups, keyed by invite hash (or the
+    @username / id the target was given as).
+    Stores the group id, title and each account's access hash, so later
+    runs can rebuild the group entity without joining, walking dialogs
+    or probing history.
+    """
+    def __init__(self, path='resolved_groups.json'):
+        self.path = path
+        self.entries = {}
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not read resolution cache {path}: {e}")
+    
+    def entity(self, key, account):
+        """Rebuild the cached group entity as seen by an account, or None"""
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        
+        real_id, peer_type = utils.resolve_id(entry['peer_id'])
+        if peer_type is PeerChat:
+            return Chat(id=real_id, title=entry['title'], photo=ChatPhotoEmpty(),
+                        participants_count=0, date=None, version=0)
+        
+        access_hash = entry['access_hashes'].get(account.name)
+        if access_hash is None:
+            return None
+        return Channel(id=real_id, title=entry['title'], photo=ChatPhotoEmpty(), date=None,
+                       access_hash=access_hash, megagroup=entry.get('megagroup'),
+                       broadcast=entry.get('broadcast'))
+    
+    def store(self, key, account, entity):
+        """Remember how an account reaches a group"""
+        if not isinstance(entity, (Channel, Chat)):
+            return
+        
+        entry = self.entries.setdefault(key, {'access_hashes': {}})
+        entry.update(
+            peer_id=utils.get_peer_id(entity),
+            title=entity.title,
+            megagroup=bool(getattr(entity, 'megagroup', False)),
+            broadcast=bool(getattr(entity, 'broadcast', False))
+        )
+        if isinstance(entity, Channel) and entity.access_hash is not None:
+            entry['access_hashes'][account.name] = entity.access_hash
+        self.save()
+    
+    def forget(self, key):
+        """Drop an entry that no longer gives access to its group"""
+        if self.entries.pop(key, None) is not None:
+            self.save()
+    
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def name_tokens(text):
+    """Lowercase word tokens used by the dialog name index"""
+    return re.findall(r'\w+', text.lower())
+
+class DialogIndex:
+    """
+    Persisted index of one account's dialogs.
+    Supports exact lookup by id, lookup by invite hash and ranked name
+    search through an in-memory token index. Refreshes are incremental:
+    iter_dialogs returns the most recently active chats first, so a walk
+    stops at the first unpinned dialog with no activity since the last one.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.invites = {}
+        self.newest_date = 0
+        self.tokens = {}
+        self.sorted_tokens = []
+        self.tokens_dirty = False
+        self.refreshed = False
+        self.lock = asyncio.Lock()
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.invites = data.get('invites', {})
+                self.newest_date = data.get('newest_date', 0)
+                for entry in data.get('dialogs', []):
+                    self.add(entry)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not read dialog index {path}: {e}")
+    
+    def add(self, entry):
+        """Insert or update a dialog, re-tokenizing its name if it changed"""
+        old = self.entries.get(entry['id'])
+        if old and old['name'] != entry['name']:
+            for token in name_tokens(old['name']):
+                self.tokens.get(token, set()).discard(entry['id'])
+        self.entries[entry['id']] = entry
+        if not old or old['name'] != entry['name']:
+            for token in name_tokens(entry['name']):
+                self.tokens.setdefault(token, set()).add(entry['id'])
+            self.tokens_dirty = True
+    
+    def is_current(self, dialog):
+        """True when a walk has reached dialogs the index already holds"""
+        if getattr(dialog, 'pinned', False) or dialog.id not in self.entries:
+            return False
+        date = int(dialog.date.timestamp()) if dialog.date else 0
+        return date <= self.newest_date
+    
+    def get(self, peer_id):
+        return self.entries.get(peer_id)
+    
+    def add_invite(self, invite_hash, peer_id):
+        """Remember which dialog an invite hash leads to"""
+        if self.invites.get(invite_hash) != peer_id:
+            self.invites[invite_hash] = peer_id
+            self.save()
+    
+    def by_invite(self, invite_hash):
+        peer_id = self.invites.get(invite_hash)
+        return self.entries.get(peer_id) if peer_id is not None else None
+    
+    def search(self, query, limit=10):
+        """
+        Rank dialogs against the words of a query. Returns
+        (entry, matched_words) pairs; an exact word beats a prefix
+        ('airdrop' matches 'airdrops'), ties go to the most recent chat.
+        """
+        if self.tokens_dirty:
+            self.sorted_tokens = sorted(t for t, ids in self.tokens.items() if ids)
+            self.tokens_dirty = False
+        
+        matched = {}
+        scores = {}
+        for word in set(name_tokens(query)):
+            hits = {peer_id: 2 for peer_id in self.tokens.get(word, ())}
+            i = bisect.bisect_left(self.sorted_tokens, word)
+            while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(word):
+                for peer_id in self.tokens[self.sorted_tokens[i]]:
+                    hits.setdefault(peer_id, 1)
+                i += 1
+            for peer_id, score in hits.items():
+                matched[peer_id] = matched.get(peer_id, 0) + 1
+                scores[peer_id] = scores.get(peer_id, 0) + score
+        
+        ranked = sorted(matched, key=lambda pid: (matched[pid], scores[pid], self.entries[pid]['date']), reverse=True)
+        return [(self.entries[pid], matched[pid]) for pid in ranked[:limit]]
+    
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'newest_date': self.newest_date, 'invites': self.invites,
+                       'dialogs': list(self.entries.values())}, f)
+        os.replace(tmp_path, self.path)
+
+# Invite link forms: t.me/+hash, t.me/joinchat/hash, telegram.me/joinchat/hash
+INVITE_LINK_PATTERN = r'(?:t\.me/\+|t\.me/joinchat/|telegram\.me/joinchat/)(?P<invite>[A-Za-z0-9_-]+)'
+INVITE_LINK_RE = re.compile(INVITE_LINK_PATTERN)
+
+# One pass over a message finds every kind of item; earlier alternatives
+# win at the same position, so invite and t.me links are not taken as plain URLs.
+# Bare t.me links must not be the tail of another domain (kraft.me/...)
+ITEM_SCANNER = re.compile(r"""
+    (?<![\w.-])(?:https?://)?(?:www\.)?""" + INVITE_LINK_PATTERN + r"""
+  | (?<![\w.-])(?:https?://)?(?:www\.)?(?:t|telegram)\.me/(?P<tme>[A-Za-z][A-Za-z0-9_]{3,31})\b
+  | (?P<url>https?://[^\s<>()\[\]{}"'`]+)
+  | (?P<address>\b0x[0-9a-fA-F]{40}\b)
+  | (?<![\w@])@(?P<handle>[A-Za-z][A-Za-z0-9_]{3,31})\b
+  | (?<![\w$])\$(?P<ticker>[A-Z][A-Z0-9]{1,9})\b
+""", re.VERBOSE)
+
+def extract_items(text, entities=None):
+    """
+    Set of (kind, value) items in a message: invite hashes, handles
+    (from @mentions and t.me links), URLs with their domains, EVM
+    addresses and $tickers. Hidden text links and mentions of users
+    without a username come from the message entities.
+    """
+    items = set()
+    sources = [text] if text else []
+    for entity in entities or ():
+        if isinstance(entity, MessageEntityTextUrl):
+            sources.append(entity.url)
+        elif isinstance(entity, MessageEntityMentionName):
+            items.add(('user', str(entity.user_id)))
+    
+    for source in sources:
+        for match in ITEM_SCANNER.finditer(source):
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind in ('tme', 'handle'):
+                items.add(('handle', value.lower()))
+            elif kind == 'url':
+                value = value.rstrip('.,;:!?')
+                items.add(('url', value))
+                domain = value.split('://', 1)[1].split('/', 1)[0].split(':', 1)[0].lower()
+                items.add(('domain', domain[4:] if domain.startswith('www.') else domain))
+            elif kind == 'address':
+                items.add(('address', value.lower()))
+            else:
+                items.add((kind, value))
+    return items
+
+class LinkIndex:
+    """
+    Inverted index from extracted items (see extract_items) to the
+    (group id, message id) pairs they appear in.
+    Updated as messages stream through; new postings are appended to a
+    JSON Lines log on flush() and replayed on load, so the index grows
+    incrementally across runs.
+    """
+    def __init__(self, path='link_index.jsonl'):
+        self.path = path
+        self.postings = {}
+        self.pending = []
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        kind, value, group_id, message_id = json.loads(line)
+                        self.postings.setdefault((kind, value), set()).add((group_id, message_id))
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not read link index {path}: {e}")
+    
+    def add(self, group_id, message_id, items):
+        for item in items:
+            messages = self.postings.setdefault(item, set())
+            if (group_id, message_id) not in messages:
+                messages.add((group_id, message_id))
+                self.pending.append([item[0], item[1], group_id, message_id])
+    
+    def lookup(self, term):
+        """
+        Messages mentioning a term, given as it would appear in a message
+        (@handle, t.me link, URL, domain, address, $ticker or invite link)
+        """
+        items = extract_items(term)
+        if not items:
+            items = {('domain', term.lower()), ('handle', term.lstrip('@').lower())}
+        return {kind_value: sorted(self.postings[kind_value]) for kind_value in items if kind_value in self.postings}
+    
+    def flush(self):
+        """Append postings added since the last flush to the log"""
+        if not self.pending:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(posting, ensure_ascii=False) + '\n' for posting in self.pending))
+        self.pending = []
+
+class ThreadIndex:
+    """
+    Reply threads of one group, built while messages stream in.
+    Every message knows its parent, children, thread root and depth.
+    History arrives newest first, so replies usually come before their
+    parents: an unseen parent is a placeholder root until it arrives,
+    then its subtree is moved under the real root in O(subtree) and the
+    messages already emitted are reported as fixups. Parents archived by
+    an earlier run are looked up through `lookup(message_id)`; replies
+    archived by an earlier run still hang off their placeholder root
+    there, so roots that found a parent are reported as subtree moves.
+    """
+    def __init__(self, lookup=None):
+        self.lookup = lookup
+        self.parent = {}
+        self.children = {}
+        self.root = {}
+        self.depth = {}
+        self.seen = set()
+        self.fixups = {}
+        self.moved = set()
+    
+    def _position(self, message_id):
+        """Position of a parent, as a placeholder root if it is unknown"""
+        if message_id not in self.root:
+            position = self.lookup(message_id) if self.lookup else None
+            if position and position[0] is not None:
+                self.root[message_id], self.depth[message_id] = position
+            else:
+                self.root[message_id], self.depth[message_id] = message_id, 0
+        return self.root[message_id], self.depth[message_id]
+    
+    def add(self, message_id, reply_to):
+        """Place a message and return its (thread_id, depth) as known now"""
+        self.seen.add(message_id)
+        if message_id not in self.root:
+            self.root[message_id], self.depth[message_id] = message_id, 0
+        if reply_to is None or message_id in self.parent:
+            return self.root[message_id], self.depth[message_id]
+        
+        self.parent[message_id] = reply_to
+        self.children.setdefault(reply_to, []).append(message_id)
+        thread_id, parent_depth = self._position(reply_to)
+        shift = parent_depth + 1 - self.depth[message_id]
+        if self.lookup and self.root[message_id] == message_id:
+            # Archived replies may still name this message as their thread root
+            self.moved.add(message_id)
+        if self.root[message_id] != thread_id or shift:
+            stack = [message_id]
+            while stack:
+                node = stack.pop()
+                self.root[node] = thread_id
+                self.depth[node] += shift
+                if node != message_id and node in self.seen:
+                    self.fixups[node] = (thread_id, self.depth[node])
+                stack.extend(self.children.get(node, ()))
+        return thread_id, self.depth[message_id]
+    
+    def thread(self, thread_id):
+        """Ids of every message in a thread, parents before replies"""
+        ids = []
+        stack = [thread_id]
+        while stack:
+            node = stack.pop()
+            if node in self.seen:
+                ids.append(node)
+            stack.extend(reversed(self.children.get(node, ())))
+        return ids
+    
+    def take_fixups(self):
+        """{message_id: (thread_id, depth)} for emitted messages that moved since the last call"""
+        fixups, self.fixups = self.fixups, {}
+        return fixups
+    
+    def take_subtrees(self):
+        """
+        {old_root: (thread_id, depth)} for placeholder roots that found a
+        parent since the last call; rows archived under old_root move to
+        thread_id with depth added to theirs
+        """
+        subtrees = {root: (self.root[root], self.depth[root]) for root in self.moved}
+        self.moved = set()
+        return subtrees
+
+MINHASH_PRIME = 4294967291  # largest prime below 2**32, keeps signatures in 32 bits
+
+def text_shingles(text, min_tokens=3):
+    """Word 3-grams of the normalized text, or None if it is too short to compare"""
+    text = re.sub(r'https?://(?:www\.)?([^/\s]+)\S*', r'\1', text.lower())
+    tokens = re.findall(r'\w+', text)
+    if len(tokens) < min_tokens:
+        return None
+    return {' '.join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))}
+
+def minhash_signature(text, perms, min_tokens=3):
+    """MinHash signature of a text's shingles, or None for short or empty texts"""
+    shingles = text_shingles(text, min_tokens) if text else None
+    if not shingles:
+        return None
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    prime = MINHASH_PRIME
+    return array('I', [min([(a * h + b) % prime for h in hashes]) for a, b in perms])
+
+class DuplicateIndex:
+    """
+    Near-duplicate detection for reposted announcements.
+    Texts are normalized (lowercase, links reduced to their domain) and
+    cut into word 3-gram shingles; a MinHash signature of the shingles is
+    split into LSH bands, so only messages sharing a band are compared.
+    A message joins the cluster whose canonical (first archived) message
+    it matches with an estimated Jaccard similarity of at least
+    `threshold`, otherwise it starts a new cluster. Only canonical
+    signatures are kept; new clusters are appended to a JSON Lines log on
+    flush() and replayed on load, so clusters span runs and groups.
+    Signatures are computed by minhash_signature, in the AnalyticsStage
+    workers for backfills; only the band lookup runs on the event loop.
+    """
+    def __init__(self, path='dedup_index.jsonl', num_perm=64, bands=16, threshold=0.7, min_tokens=3):
+        self.path = path
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.threshold = threshold
+        self.min_tokens = min_tokens
+        rng = random.Random(1)  # Fixed so signatures stay comparable across runs
+        self.perms = [(rng.randrange(1, MINHASH_PRIME), rng.randrange(MINHASH_PRIME)) for _ in range(num_perm)]
+        self.signatures = {}
+        self.canonical = {}
+        self.buckets = {}
+        self.pending = []
+        self.next_id = 1
+        self.duplicates = 0
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        cluster_id, group_id, message_id, signature = json.loads(line)
+                        self._add_cluster(cluster_id, (group_id, message_id),
+                                          array('I', base64.b64decode(signature)))
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not read dedup index {path}: {e}")
+    
+    def signature(self, text):
+        """Signature computed inline, for the few messages that skip the worker pool"""
+        return minhash_signature(text, self.perms, self.min_tokens)
+    
+    def band_keys(self, signature):
+        rows = self.rows
+        return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+    
+    def _add_cluster(self, cluster_id, canonical, signature):
+        self.signatures[cluster_id] = signature
+        self.canonical[cluster_id] = canonical
+        for key in self.band_keys(signature):
+            self.buckets.setdefault(key, []).append(cluster_id)
+        self.next_id = max(self.next_id, cluster_id + 1)
+    
+    def assign(self, group_id, message_id, signature):
+        """Cluster id for a message's signature (None for short or empty texts)"""
+        if signature is None:
+            return None
+        
+        keys = self.band_keys(signature)
+        best_id, best_score = None, self.threshold
+        seen = set()
+        for key in keys:
+            for cluster_id in self.buckets.get(key, ()):
+                if cluster_id in seen:
+                    continue
+                seen.add(cluster_id)
+                other = self.signatures[cluster_id]
+                score = sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+                if score >= best_score:
+                    best_id, best_score = cluster_id, score
+        
+        if best_id is not None:
+            if self.canonical[best_id] != (group_id, message_id):
+                self.duplicates += 1
+            return best_id
+        
+        cluster_id = self.next_id
+        self._add_cluster(cluster_id, (group_id, message_id), signature)
+        self.pending.append([cluster_id, group_id, message_id, base64.b64encode(signature.tobytes()).decode('ascii')])
+        return cluster_id
+    
+    def is_canonical(self, group_id, record):
+        """True unless the record is a repost of another cluster's first message"""
+        return record.cluster_id is None or self.canonical[record.cluster_id] == (group_id, record.id)
+    
+    def flush(self):
+        """Append clusters created since the last flush to the log"""
+        if not self.pending:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(entry) + '\n' for entry in self.pending))
+        self.pending = []
+
 class TelegramScraper:
-    def __init__(self):
+    def __init__(self, checkpoint_file='scrape_checkpoints.json', max_in_flight=4, archive_file='telegram_archive.db',
+                 resolution_file='resolved_groups.json', quick_connect=False, media=None,
+                 link_index_file=None, dedup=None, canonical_only=False, threads=False,
+                 analytics=None, compression=None, rotate_bytes=None, rotate_rows=None):
         """
         Initialize Telegram scraper with environment variables
         """
@@ -34,52 +2084,103 @@ class TelegramScraper:
         except ValueError:
             raise ValueError("TELEGRAM_API_ID must be a number")
         
-        self.client = TelegramClient('session', self.api_id, self.api_hash)
+        self.pool = ClientPool(load_accounts(self.api_id, self.api_hash, self.phone_number))
+        self.pool.resolve_peer = self._resolve_on_account
+        self.scheduler = RequestScheduler(self.pool, max_in_flight * len(self.pool.accounts))
+        self.senders = SenderResolver(self.pool, self.scheduler)
+        self.checkpoints = CheckpointStore(checkpoint_file)
+        self.archive_file = archive_file
+        self.resolutions = ResolutionCache(resolution_file)
+        # Reuse authorized sessions without the get_me round trip
+        self.quick_connect = quick_connect
+        # Optional MediaDownloader; None leaves media_path empty
+        self.media = media
+        # Optional inverted index of links, handles and addresses (--links)
+        self.links = LinkIndex(link_index_file) if link_index_file else None
+        # Optional DuplicateIndex filling cluster_id; canonical_only drops reposts from exports
+        self.dedup = dedup
+        self.canonical_only = canonical_only and dedup is not None
+        # Per-group ThreadIndex filling thread_id/depth, when enabled
+        self.threads = {} if threads else None
+        self.thread_archive = None
+        # Optional AnalyticsStage filling lang/airdrop_score off the event loop;
+        # dedup needs one too, for its signatures, even without analytics
+        if analytics is None and dedup is not None:
+            analytics = AnalyticsStage(analyze=False)
+        self.analytics = analytics
+        # Compression and rotation for the CSV/JSON sinks
+        self.file_options = {'compression': compression, 'max_bytes': rotate_bytes, 'max_rows': rotate_rows}
+        self.queue_stats = {}
+        self.group_targets = {}
+        # Sharded backfills split the window into ranges of this many pages,
+        # and each worker may run this many ranges ahead of the ordered merge
+        self.shard_range_pages = 5
+        self.shard_lookahead = 4
         print(f"🔧 Initialized with phone: {self.phone_number}")
+        if len(self.pool.accounts) > 1:
+            print(f"👥 Account pool: {len(self.pool.accounts)} accounts")
+    
+    @property
+    def client(self):
+        """Client of the account the current task runs on"""
+        return self.pool.current().client
+    
+    @property
+    def limiter(self):
+        """Rate limiter of the account the current task runs on"""
+        return self.pool.current().limiter
         
     async def connect(self):
-        """Connect to Telegram and authenticate"""
+        """Connect to Telegram and authenticate every pooled account"""
         print("🔗 Connecting to Telegram...")
-        await self.client.start(phone=self.phone_number)
-        
-        # Get current user info
-        me = await self.client.get_me()
-        print(f"✅ Connected as: {me.first_name} (@{me.username if me.username else 'no_username'})")
+        for account in self.pool.accounts:
+            if self.quick_connect:
+                await account.client.connect()
+                if await account.client.is_user_authorized():
+                    print(f"✅ Connected {account.name} (saved session)")
+                    continue
+            
+            await account.client.start(phone=account.phone_number)
+            
+            # Get current user info
+            me = await account.limiter.call(account.client.get_me)
+            print(f"✅ Connected as: {me.first_name} (@{me.username if me.username else 'no_username'})")
+    
+    async def _resolve_on_account(self, account, peer_id):
+        """Make a group scraped by one account usable from another"""
+        token = current_account.set(account)
+        try:
+            try:
+                return await self.scheduler.call(account.client.get_input_entity, peer_id)
+            except ValueError:
+                pass
+            
+            target = self.group_targets.get(peer_id)
+            if not target:
+                return None
+            entity = self.cached_group(target) or await self.resolve_target(target)
+            return utils.get_input_peer(entity) if entity else None
+        finally:
+            current_account.reset(token)
         
     def extract_invite_hash(self, invite_link):
         """
         Extract invite hash from Telegram invite link
         """
-        patterns = [
-            r't\.me/\+([A-Za-z0-9_-]+)',
-            r't\.me/joinchat/([A-Za-z0-9_-]+)',
-            r'telegram\.me/joinchat/([A-Za-z0-9_-]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, invite_link)
-            if match:
-                return match.group(1)
-        
-        return None
+        match = INVITE_LINK_RE.search(invite_link)
+        return match.group(1) if match else None
+    
+    async def rpc(self, request):
+        """Send a raw API request through the scheduler and rate limiter"""
+        return await self.scheduler.call(self.client, request)
     
     async def get_all_dialogs(self):
         """
         Get all user dialogs for debugging
         """
         print("📋 Listing all available dialogs...")
-        dialogs = []
-        
-        async for dialog in self.client.iter_dialogs():
-            dialog_info = {
-                'name': dialog.name,
-                'id': dialog.id,
-                'type': type(dialog.entity).__name__,
-                'is_group': hasattr(dialog.entity, 'megagroup') and dialog.entity.megagroup,
-                'is_channel': hasattr(dialog.entity, 'broadcast') and dialog.entity.broadcast,
-                'is_chat': type(dialog.entity).__name__ == 'Chat'
-            }
-            dialogs.append(dialog_info)
+        index = await self.refresh_dialogs()
+        dialogs = list(index.entries.values())
             
         # Sort by name for better readability
         dialogs.sort(key=lambda x: x['name'].lower())
@@ -93,6 +2194,50 @@ class TelegramScraper:
             
         return dialogs
     
+    async def refresh_dialogs(self, full=False):
+        """
+        Bring the current account's dialog index up to date, walking
+        only the dialogs active since the last refresh unless full=True
+        """
+        index = self.pool.current().dialogs
+        async with index.lock:
+            full = full or not index.entries
+            updated = await self.scheduler.call(self._walk_dialogs, index, full)
+            index.refreshed = True
+            index.save()
+        print(f"{group_prefix()}📇 Dialog index: {len(index.entries)} dialogs ({updated} {'indexed' if full else 'updated'})")
+        return index
+    
+    async def _walk_dialogs(self, index, full, page_size=100):
+        """
+        Feed dialogs into the index, taking a limiter token for every page
+        iter_dialogs fetches
+        """
+        updated = 0
+        newest_date = index.newest_date
+        
+        async for dialog in self.client.iter_dialogs():
+            if updated and updated % page_size == 0:
+                await self.limiter.acquire()
+            if not full and index.is_current(dialog):
+                break
+            
+            date = int(dialog.date.timestamp()) if dialog.date else 0
+            newest_date = max(newest_date, date)
+            index.add({
+                'name': dialog.name,
+                'id': dialog.id,
+                'type': type(dialog.entity).__name__,
+                'is_group': bool(getattr(dialog.entity, 'megagroup', False)),
+                'is_channel': bool(getattr(dialog.entity, 'broadcast', False)),
+                'is_chat': type(dialog.entity).__name__ == 'Chat',
+                'date': date
+            })
+            updated += 1
+        
+        index.newest_date = newest_date
+        return updated
+    
     async def join_group_by_link(self, invite_link):
         """
         Join group using invite link and return group entity
@@ -107,10 +2252,11 @@ class TelegramScraper:
             
             try:
                 print("📥 Attempting to join group...")
-                result = await self.client(ImportChatInviteRequest(invite_hash))
+                result = await self.rpc(ImportChatInviteRequest(invite_hash))
                 
                 if hasattr(result, 'chats') and result.chats:
                     chat = result.chats[0]
+                    self.pool.current().dialogs.add_invite(invite_hash, utils.get_peer_id(chat))
                     print(f"✅ Successfully joined group: {chat.title}")
                     print(f"   📊 Group ID: {chat.id}")
                     print(f"   👥 Members: {getattr(chat, 'participants_count', 'Unknown')}")
@@ -121,6 +2267,10 @@ class TelegramScraper:
                     
             except UserAlreadyParticipantError:
                 print("ℹ️  Already a member of this group!")
+                invite = await self.rpc(CheckChatInviteRequest(invite_hash))
+                if getattr(invite, 'chat', None):
+                    self.pool.current().dialogs.add_invite(invite_hash, utils.get_peer_id(invite.chat))
+                    return invite.chat
                 return await self.find_group_in_dialogs(invite_hash)
                 
             except InviteHashEmptyError:
@@ -139,26 +2289,27 @@ class TelegramScraper:
     
     async def find_group_in_dialogs(self, invite_hash=None):
         """
-        Find the target group in dialogs
+        Find the target group in the account's dialog index
         """
         print("🔍 Searching for target group in dialogs...")
+        index = self.pool.current().dialogs
+        if not index.entries:
+            await self.refresh_dialogs()
         
-        # Get all dialogs first
-        dialogs = await self.get_all_dialogs()
+        dialog = index.by_invite(invite_hash) if invite_hash else None
+        if dialog:
+            print(f"🎯 Invite already known: {dialog['name']}")
+            try:
+                return await self.scheduler.call(self.client.get_entity, dialog['id'])
+            except Exception as e:
+                print(f"❌ Could not get entity: {e}")
         
         # Look for groups with "airdrop" and "list" in the name
-        target_keywords = ['airdrop', 'list', 'link']
-        possible_groups = []
-        
-        for dialog in dialogs:
-            dialog_name_lower = dialog['name'].lower()
-            keyword_matches = sum(1 for keyword in target_keywords if keyword in dialog_name_lower)
-            
-            if keyword_matches >= 2:  # At least 2 keywords match
-                possible_groups.append((dialog, keyword_matches))
-                
-        # Sort by number of keyword matches
-        possible_groups.sort(key=lambda x: x[1], reverse=True)
+        possible_groups = [(d, m) for d, m in index.search('airdrop list link') if m >= 2]  # At least 2 keywords match
+        if not possible_groups and not index.refreshed:
+            # The group may have been joined since the index was last refreshed
+            await self.refresh_dialogs()
+            possible_groups = [(d, m) for d, m in index.search('airdrop list link') if m >= 2]
         
         if possible_groups:
             print(f"🎯 Found {len(possible_groups)} possible target groups:")
@@ -169,7 +2320,7 @@ class TelegramScraper:
             best_match = possible_groups[0][0]
             try:
                 print(f"🎯 Trying to access: {best_match['name']}")
-                entity = await self.client.get_entity(best_match['id'])
+                entity = await self.scheduler.call(self.client.get_entity, best_match['id'])
                 print(f"✅ Successfully got entity for: {entity.title}")
                 return entity
             except Exception as e:
@@ -179,226 +2330,719 @@ class TelegramScraper:
         print("❓ Could not automatically identify target group.")
         print("📋 All available groups:")
         
-        groups_only = [d for d in dialogs if d['is_group'] or d['is_channel'] or d['is_chat']]
+        groups_only = [d for d in index.entries.values() if d['is_group'] or d['is_channel'] or d['is_chat']]
         for i, dialog in enumerate(groups_only[:20]):  # Show first 20 groups
             print(f"   {i+1}. {dialog['name']} ({dialog['type']})")
             
         return None
     
-    async def get_group_messages(self, group_entity, months_back=6, limit=None):
+    async def get_group_messages(self, group_entity, months_back=6, limit=None, resume=True, shards=1,
+                                 since=None, until=None):
         """
         Get messages from group for specified time period
         """
+        # Reject a reversed window up front
+        message_window(since, until, months_back)
+        messages_data = []
+        async for batch in self.iter_message_batches(group_entity, months_back, limit, resume, shards=shards,
+                                                     since=since, until=until):
+            if self.dedup is not None:
+                group_id = utils.get_peer_id(group_entity)
+                for record in batch:
+                    record.cluster_id = self.dedup.assign(group_id, record.id, self.dedup.signature(record.text))
+            messages_data.extend(batch)
+        return messages_data
+    
+    async def iter_message_batches(self, group_entity, months_back=6, limit=None, resume=True, prefetch=2, shards=1,
+                                   since=None, until=None):
+        """
+        Yield extracted messages one fetched batch at a time.
+        The window runs from `since` (default: months_back before `until`)
+        to `until` (default: now). Its start is turned into a message id
+        once, and every request stops there through min_id; a historical
+        `until` is reached directly with offset_date.
+        
+        With resume enabled, only messages missing from the group's
+        checkpoint are fetched: new ones above the archived max id first,
+        then any unfinished backfill below the archived min id. Historical
+        slices (an explicit `until`) never touch checkpoints.
+        
+        Pages are fetched by a producer task that keeps up to `prefetch`
+        pages queued ahead of extraction, so the network is never idle
+        while a batch is being processed and written. With shards > 1
+        the backfill is split into id ranges fetched in parallel.
+        """
         # Calculate date range
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=months_back * 30)
+        start_date, end_date = message_window(since, until, months_back)
         
         group_name = getattr(group_entity, 'title', 'Unknown Group')
-        print(f"📥 Fetching messages from '{group_name}'")
-        print(f"📅 Date range: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+        group_id = utils.get_peer_id(group_entity)
+        print(f"{group_prefix()}📥 Fetching messages from '{group_name}'")
+        print(f"{group_prefix()}📅 Date range: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
         
-        messages_data = []
-        offset_id = 0
-        batch_size = 100
+        checkpoint = self.checkpoints.get(group_id) if resume and not until else None
+        if until:
+            passes = [{'name': 'slice', 'offset_id': 0, 'offset_date': end_date, 'min_id': 0}]
+        elif checkpoint:
+            print(f"{group_prefix()}📌 Resuming from checkpoint: ids {checkpoint['min_id']}..{checkpoint['max_id']} already archived")
+            passes = [{'name': 'new', 'offset_id': 0, 'min_id': checkpoint['max_id']}]
+            if self.checkpoints.needs_backfill(group_id, start_date):
+                passes.append({'name': 'backfill', 'offset_id': checkpoint['min_id'], 'min_id': 0})
+        else:
+            passes = [{'name': 'backfill', 'offset_id': 0, 'min_id': 0}]
+        
+        queue = asyncio.Queue(maxsize=prefetch)
+        queue_stats = {'capacity': prefetch, 'max_depth': 0, 'depth_total': 0, 'samples': 0}
+        self.queue_stats[group_id] = queue_stats
+        producer = asyncio.create_task(self._produce_pages(group_entity, passes, start_date, queue, shards))
+        
+        total = 0
         batch_count = 0
+        newest_id = None
         
         try:
             while True:
+                # Time spent here is the consumer starving for pages
+                with metrics.timer('stage', stage='fetch'):
+                    item = await queue.get()
+                if item is None:
+                    break
+                
+                kind, fetch_pass, payload = item
+                if kind == 'error':
+                    if not total and isinstance(payload, ACCESS_ERRORS):
+                        # Nothing fetched yet: the group itself is unreadable
+                        raise payload
+                    print(f"{group_prefix()}❌ Error fetching messages: {payload}")
+                    import traceback
+                    traceback.print_exception(payload)
+                    break
+                
+                if kind == 'end':
+                    # The new-message pass only counts once it reached the archived max id
+                    if fetch_pass['name'] == 'new' and newest_id is not None:
+                        self.checkpoints.stage(group_id, max_id=newest_id)
+                    if fetch_pass['name'] == 'backfill':
+                        if payload:
+                            self.checkpoints.stage(group_id, exhausted=True)
+                        else:
+                            # Archive now reaches back to the start of the window
+                            self.checkpoints.stage(group_id, oldest_date=start_date.strftime('%Y-%m-%d %H:%M:%S'))
+                    newest_id = None
+                    continue
+                
+                history = payload
                 batch_count += 1
-                print(f"📦 Fetching batch #{batch_count}...")
+                depth = queue.qsize()
+                queue_stats['max_depth'] = max(queue_stats['max_depth'], depth)
+                queue_stats['depth_total'] += depth
+                queue_stats['samples'] += 1
                 
-                history = await self.client(GetHistoryRequest(
-                    peer=group_entity,
-                    offset_id=offset_id,
-                    offset_date=None,
-                    add_offset=0,
-                    limit=batch_size,
-                    max_id=0,
-                    min_id=0,
-                    hash=0
-                ))
+                # Resolve senders from the page itself, one lookup for the rest
+                with metrics.timer('stage', stage='senders'):
+                    self.senders.ingest(history.users, history.chats)
+                    await self.senders.prefetch(m.sender_id for m in history.messages)
                 
-                if not history.messages:
-                    print("📭 No more messages found.")
-                    break
+                if newest_id is None:
+                    newest_id = history.messages[0].id
+                    if fetch_pass['name'] == 'backfill' and not checkpoint:
+                        self.checkpoints.stage(group_id, max_id=newest_id)
                 
-                messages_in_batch = 0
+                batch = []
                 oldest_date = None
+                last_id = None
                 
+                # Every page is already inside the window thanks to min_id
+                extract_started = time.perf_counter()
                 for message in history.messages:
                     # Track oldest message date in this batch
                     if oldest_date is None or message.date < oldest_date:
                         oldest_date = message.date
                     
-                    # Check if message is within our date range
-                    if message.date < start_date:
-                        print(f"⏰ Reached messages older than {months_back} months.")
-                        print(f"   Oldest message date: {oldest_date.strftime('%Y-%m-%d %H:%M:%S')}")
-                        print(f"   Cutoff date: {start_date.strftime('%Y-%m-%d %H:%M:%S')}")
-                        return messages_data
-                    
                     # Extract message data
-                    message_data = await self.extract_message_data(message)
-                    messages_data.append(message_data)
-                    messages_in_batch += 1
-                    
-                    # Update offset for next batch
-                    offset_id = message.id
+                    batch.append(await self.extract_message_data(message))
+                    last_id = message.id
+                metrics.observe('stage', time.perf_counter() - extract_started, stage='extract')
+                
+                if fetch_pass['name'] == 'backfill' and batch:
+                    self.checkpoints.stage(group_id, min_id=last_id,
+                                           oldest_date=batch[-1].date_text)
                 
-                print(f"   ✅ Processed {messages_in_batch} messages from batch #{batch_count}")
-                print(f"   📊 Total messages so far: {len(messages_data)}")
-                if oldest_date:
-                    print(f"   📅 Oldest message in batch: {oldest_date.strftime('%Y-%m-%d %H:%M:%S')}")
+                total += len(batch)
+                metrics.inc('pages')
+                metrics.inc('messages', len(batch))
+                log_event('batch', batch=batch_count, messages=len(batch), total=total,
+                          rate=round(self.limiter.rate, 2), queued=depth, oldest=oldest_date)
                 
-                # Add delay to avoid rate limiting
-                await asyncio.sleep(1)
+                # Hand the batch downstream; the producer keeps fetching meanwhile
+                if batch:
+                    yield batch
                 
                 # Check limit if specified
-                if limit and len(messages_data) >= limit:
-                    print(f"📏 Reached specified limit of {limit} messages.")
+                if limit and total >= limit:
+                    print(f"{group_prefix()}📏 Reached specified limit of {limit} messages.")
                     break
+        finally:
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+        
+        avg_depth = queue_stats['depth_total'] / max(1, queue_stats['samples'])
+        print(f"{group_prefix()}🏁 Finished fetching messages.")
+        print(f"{group_prefix()}   📊 Total messages collected: {total}")
+        print(f"{group_prefix()}   📦 Total batches processed: {batch_count}")
+        print(f"{group_prefix()}   📬 Prefetch queue depth: avg {avg_depth:.1f}, max {queue_stats['max_depth']}/{prefetch}")
+        print(f"{group_prefix()}   👤 Sender cache: {self.senders.hits} hits, {self.senders.misses} misses")
+        print(f"{group_prefix()}   ⚡ Rate limiter: {self.limiter.stats()}")
+    
+    async def _produce_pages(self, group_entity, passes, start_date, queue, shards=1, batch_size=100):
+        """
+        Fetch history pages for each pass into the queue.
+        Each pass ends with an ('end', pass, exhausted) marker and the whole
+        run with None; errors are handed to the consumer instead of raised.
+        With shards > 1 the backfill pass is fetched as parallel id ranges.
+        """
+        page_count = 0
+        try:
+            # One lookup turns the window start into an id every request stops at
+            since_id = await self._find_boundary_id(group_entity, start_date)
+            
+            for fetch_pass in passes:
+                offset_id = fetch_pass['offset_id']
+                offset_date = fetch_pass.get('offset_date')
+                min_id = max(fetch_pass['min_id'], since_id)
+                
+                if fetch_pass['name'] in ('backfill', 'slice') and shards > 1:
+                    await self._produce_sharded(group_entity, fetch_pass, since_id, queue, shards, batch_size)
+                    continue
+                
+                if fetch_pass['name'] == 'new':
+                    print(f"{group_prefix()}🆕 Fetching messages newer than id {fetch_pass['min_id']}...")
+                elif offset_id:
+                    print(f"{group_prefix()}⏪ Resuming backfill below id {offset_id}...")
+                elif offset_date:
+                    print(f"{group_prefix()}⏩ Seeking to {offset_date.strftime('%Y-%m-%d %H:%M:%S')}...")
+                
+                while True:
+                    page_count += 1
+                    log_event('fetch', page=page_count, offset_id=offset_id, min_id=min_id)
+                    
+                    history = await self.rpc(GetHistoryRequest(
+                        peer=group_entity,
+                        offset_id=offset_id,
+                        offset_date=None if offset_id else offset_date,
+                        add_offset=0,
+                        limit=batch_size,
+                        max_id=0,
+                        min_id=min_id,
+                        hash=0
+                    ))
                     
+                    if not history.messages:
+                        if since_id and min_id == since_id:
+                            print(f"{group_prefix()}⏰ Reached the start of the window ({start_date.strftime('%Y-%m-%d %H:%M:%S')}).")
+                        else:
+                            print(f"{group_prefix()}📭 No more messages found.")
+                        await queue.put(('end', fetch_pass, since_id == 0))
+                        break
+                    
+                    await queue.put(('page', fetch_pass, history))
+                    offset_id = history.messages[-1].id
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"❌ Error fetching messages: {e}")
-            import traceback
-            traceback.print_exc()
+            await queue.put(('error', None, e))
+        
+        await queue.put(None)
+    
+    async def _find_boundary_id(self, group_entity, date=None):
+        """
+        Id of the newest message sent before `date` (or the newest message
+        overall when date is None); 0 when there is none
+        """
+        history = await self.rpc(GetHistoryRequest(
+            peer=group_entity,
+            offset_id=0,
+            offset_date=date,
+            add_offset=0,
+            limit=1,
+            max_id=0,
+            min_id=0,
+            hash=0
+        ))
+        return history.messages[0].id if history.messages else 0
+    
+    async def _produce_sharded(self, group_entity, fetch_pass, low, queue, shards, batch_size=100):
+        """
+        Backfill the date window as small disjoint id ranges handed out
+        newest-first to `shards` concurrent workers (spread over pooled
+        accounts), then merge them into the queue newest-first with
+        duplicates dropped, so the consumer and checkpoints see the same
+        order as a sequential backfill. A worker takes the next free range
+        as soon as it finishes one, staying at most shard_lookahead ranges
+        per worker ahead of the merge.
+        """
+        # Id bounds of the window: everything in (low, high) is inside it
+        high = fetch_pass['offset_id'] or (await self._find_boundary_id(group_entity, fetch_pass.get('offset_date')) + 1)
+        if high - low <= 1:
+            await queue.put(('end', fetch_pass, low == 0))
+            return
         
-        print(f"🏁 Finished fetching messages.")
-        print(f"   📊 Total messages collected: {len(messages_data)}")
-        print(f"   📦 Total batches processed: {batch_count}")
+        step = self.shard_range_pages * batch_size
+        ranges = []
+        top = high - 1
+        while top > low:
+            bottom = max(low + 1, top - step + 1)
+            ranges.append((top, bottom))
+            top = bottom - 1
         
-        return messages_data
+        # Workers go round-robin over the accounts that can see this group
+        group_id = utils.get_peer_id(group_entity)
+        owner = self.pool.current()
+        accounts = [(owner, group_entity)]
+        for account in self.pool.accounts:
+            if account is not owner:
+                input_peer = await self.pool.peer_for(account, group_id)
+                if input_peer:
+                    accounts.append((account, input_peer))
+        
+        workers = min(shards, len(ranges))
+        print(f"{group_prefix()}🧩 Sharded backfill of ids {low + 1}..{high - 1}: "
+              f"{len(ranges)} ranges, {workers} workers over {len(accounts)} account(s)")
+        
+        buffers = [asyncio.Queue() for _ in ranges]
+        pending = iter(range(len(ranges)))
+        window = workers * self.shard_lookahead
+        merged = 0
+        progress = asyncio.Condition()
+        
+        async def worker(account, peer):
+            for index in pending:
+                async with progress:
+                    await progress.wait_for(lambda: index < merged + window)
+                top, bottom = ranges[index]
+                await self._fetch_shard(index, account, peer, top, bottom, buffers[index], batch_size)
+        
+        tasks = [asyncio.create_task(worker(*accounts[n % len(accounts)])) for n in range(workers)]
+        
+        try:
+            last_id = high
+            for buffer in buffers:
+                while True:
+                    history = await buffer.get()
+                    if history is None:
+                        break
+                    if isinstance(history, Exception):
+                        raise history
+                    
+                    # Ranges are disjoint, but never hand the consumer an id twice
+                    history.messages = [m for m in history.messages if m.id < last_id]
+                    if not history.messages:
+                        continue
+                    last_id = history.messages[-1].id
+                    await queue.put(('page', fetch_pass, history))
+                
+                merged += 1
+                async with progress:
+                    progress.notify_all()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        await queue.put(('end', fetch_pass, low == 0))
+    
+    async def _fetch_shard(self, index, account, peer, top, bottom, buffer, batch_size=100):
+        """Page backward through ids bottom..top into the range's buffer"""
+        current_account.set(account)
+        offset_id = top + 1
+        page_count = 0
+        try:
+            while offset_id > bottom:
+                page_count += 1
+                log_event('fetch', range=index + 1, account=account.name, page=page_count, offset_id=offset_id)
+                
+                history = await self.rpc(GetHistoryRequest(
+                    peer=peer,
+                    offset_id=offset_id,
+                    offset_date=None,
+                    add_offset=0,
+                    limit=batch_size,
+                    max_id=0,
+                    min_id=bottom - 1,
+                    hash=0
+                ))
+                
+                if not history.messages:
+                    break
+                await buffer.put(history)
+                offset_id = history.messages[-1].id
+        except Exception as e:
+            await buffer.put(e)
+            return
+        
+        await buffer.put(None)
     
     async def extract_message_data(self, message):
         """
-        Extract relevant data from a message
+        Extract relevant data from a message into a compact MessageRecord
         """
         # Get sender information
         sender_info = "Unknown"
         if message.sender_id:
-            try:
-                sender = await self.client.get_entity(message.sender_id)
-                if hasattr(sender, 'username') and sender.username:
-                    sender_info = f"@{sender.username}"
-                elif hasattr(sender, 'first_name'):
-                    sender_info = sender.first_name
-                    if hasattr(sender, 'last_name') and sender.last_name:
-                        sender_info += f" {sender.last_name}"
-            except:
-                sender_info = f"ID: {message.sender_id}"
-        
-        # Extract message text
-        text = message.text if message.text else ""
-        
-        # Handle media messages
-        media_type = None
-        media_info = ""
-        if message.media:
-            media_type = type(message.media).__name__
-            if hasattr(message.media, 'document') and hasattr(message.media.document, 'mime_type'):
-                media_info = message.media.document.mime_type
+            sender_info = self.senders.lookup(message.sender_id)
+            if sender_info is None:
+                sender_info = await self.senders.resolve(message.sender_id)
         
-        return {
-            'id': message.id,
-            'date': message.date.strftime('%Y-%m-%d %H:%M:%S'),
-            'sender': sender_info,
-            'text': text,
-            'media_type': media_type,
-            'media_info': media_info,
-            'reply_to': message.reply_to.reply_to_msg_id if message.reply_to else None,
-            'views': getattr(message, 'views', None),
-            'forwards': getattr(message, 'forwards', None),
-            'is_reply': bool(message.reply_to)
-        }
+        record = MessageRecord.from_message(message, sender_info)
+        group_id = utils.get_peer_id(message.peer_id)
+        if self.links is not None:
+            self.links.add(group_id, message.id, extract_items(message.message, message.entities))
+        if self.threads is not None:
+            record.thread_id, record.depth = self.thread_index(group_id).add(message.id, record.reply_to)
+        if self.media is not None and message.media is not None:
+            record.media_path = self.media.submit(self.pool.current(), message.media)
+        return record
     
     async def save_to_csv(self, messages_data, filename):
         """Save messages data to CSV file"""
+        return self._save_with_sink(CsvSink(filename), messages_data)
+    
+    async def save_to_json(self, messages_data, filename):
+        """Save messages data to JSON file"""
+        return self._save_with_sink(JsonArraySink(filename), messages_data)
+    
+    def _save_with_sink(self, sink, messages_data):
+        """Write a complete list of messages through a single sink"""
         if not messages_data:
             print("❌ No messages to save!")
             return False
         
         try:
-            abs_path = os.path.abspath(filename)
-            print(f"💾 Saving CSV to: {abs_path}")
-            
-            with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['id', 'date', 'sender', 'text', 'media_type', 'media_info', 'reply_to', 'views', 'forwards', 'is_reply']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                
-                writer.writeheader()
-                for message in messages_data:
-                    writer.writerow(message)
-            
-            if os.path.exists(filename):
-                file_size = os.path.getsize(filename)
-                print(f"✅ CSV file saved successfully!")
-                print(f"   📁 Location: {abs_path}")
-                print(f"   📊 Size: {file_size} bytes")
-                print(f"   📝 Messages: {len(messages_data)}")
-                return True
-            else:
-                print(f"❌ CSV file was not created!")
-                return False
-                
+            print(f"💾 Saving {sink.label} to: {os.path.abspath(sink.filename)}")
+            sink.write_batch(messages_data)
+            sink.close()
+            return self._report_sink(sink)
         except Exception as e:
-            print(f"❌ Error saving CSV file: {e}")
+            print(f"❌ Error saving {sink.label} file: {e}")
             return False
     
-    async def save_to_json(self, messages_data, filename):
-        """Save messages data to JSON file"""
-        if not messages_data:
-            print("❌ No messages to save!")
+    def _report_sink(self, sink):
+        """Print where a finished sink wrote its file"""
+        if sink.count and os.path.exists(sink.filename):
+            file_size = sink.disk_size()
+            print(f"{group_prefix()}✅ {sink.label} file saved successfully!")
+            print(f"{group_prefix()}   📁 Location: {os.path.abspath(sink.filename)}")
+            if sink.rotating:
+                print(f"{group_prefix()}   🗂️  Chunks: {len(sink.chunks)}")
+            print(f"{group_prefix()}   📊 Size: {file_size} bytes")
+            print(f"{group_prefix()}   📝 Messages: {sink.count}")
+            return True
+        else:
+            print(f"{group_prefix()}❌ {sink.label} file was not created!")
             return False
-            
+    
+    def thread_index(self, group_id):
+        """ThreadIndex of a group, reading parents from earlier runs out of the SQLite archive"""
+        if group_id not in self.threads:
+            lookup = None
+            if os.path.exists(self.archive_file):
+                if self.thread_archive is None:
+                    self.thread_archive = MessageArchive(self.archive_file)
+                lookup = lambda message_id: self.thread_archive.thread_position(group_id, message_id)
+            self.threads[group_id] = ThreadIndex(lookup)
+        return self.threads[group_id]
+    
+    async def _drain_media(self):
+        """Wait for queued downloads, then drop the paths of failed ones from the archive"""
+        await self.media.drain()
+        if self.media.failed_paths and os.path.exists(self.archive_file):
+            archive = MessageArchive(self.archive_file)
+            try:
+                archive.clear_media_paths(self.media.failed_paths)
+            finally:
+                archive.close()
+    
+    def _report_duplicates(self):
+        """Print how many reposts the dedup stage found this run"""
+        if self.dedup is not None:
+            action = "left out of exports" if self.canonical_only else "tagged with their cluster_id"
+            print(f"🧬 Near-duplicates: {self.dedup.duplicates} reposts {action}")
+    
+    def create_sinks(self, output_format, base_name, group_entity=None):
+        """
+        Build export sinks for an output format: 'csv', 'json', 'jsonl',
+        'sqlite', 'parquet', 'both' (csv + json) or a comma separated combination.
+        The SQLite archive is one shared file across groups and runs.
+        CSV and JSON outputs take the scraper's compression and rotation
+        settings.
+        """
+        if output_format == 'both':
+            formats = ['csv', 'json']
+        else:
+            formats = [f.strip() for f in output_format.split(',') if f.strip()]
+        
+        sinks = []
+        for fmt in formats:
+            if fmt not in SINK_FORMATS:
+                raise ValueError(f"Unknown output format '{fmt}'. Choose from: {', '.join(SINK_FORMATS)}, both")
+            sink_class = SINK_FORMATS[fmt]
+            if sink_class is SqliteSink:
+                sinks.append(SqliteSink(self.archive_file, group_entity))
+            elif sink_class is ParquetSink:
+                sinks.append(ParquetSink(f"{base_name}{sink_class.extension}"))
+            else:
+                sinks.append(sink_class(f"{base_name}{sink_class.extension}", **self.file_options))
+        return sinks
+    
+    async def export_messages(self, group_entity, sinks, months_back=6, limit=None, resume=True, shards=1,
+                              since=None, until=None):
+        """
+        Stream fetched batches into every sink in a single pass.
+        With the analytics stage on, up to its window of batches is being
+        analysed (and signed for dedup) while fetching continues; batches
+        are still clustered and written in order. Each batch's checkpoint progress is committed once that
+        batch reaches disk.
+        """
+        group_id = utils.get_peer_id(group_entity)
+        batches = self.iter_message_batches(group_entity, months_back, limit, resume, shards=shards,
+                                            since=since, until=until)
+        pipeline = deque()
+        total = 0
+        
         try:
-            abs_path = os.path.abspath(filename)
-            print(f"💾 Saving JSON to: {abs_path}")
+            async for batch in batches:
+                progress = self.checkpoints.snapshot(group_id)
+                if self.analytics is not None:
+                    pipeline.append((batch, progress, self.analytics.submit(batch, self.dedup)))
+                    if len(pipeline) < self.analytics.window:
+                        continue
+                    batch, progress, job = pipeline.popleft()
+                    await self._apply_features(group_id, batch, job)
+                total += self._write_batch(group_id, batch, progress, sinks, total, pipeline)
             
-            with open(filename, 'w', encoding='utf-8') as jsonfile:
-                json.dump(messages_data, jsonfile, ensure_ascii=False, indent=2)
+            while pipeline:
+                batch, progress, job = pipeline.popleft()
+                await self._apply_features(group_id, batch, job)
+                total += self._write_batch(group_id, batch, progress, sinks, total, pipeline)
             
-            if os.path.exists(filename):
-                file_size = os.path.getsize(filename)
-                print(f"✅ JSON file saved successfully!")
-                print(f"   📁 Location: {abs_path}")
-                print(f"   📊 Size: {file_size} bytes")
-                print(f"   📝 Messages: {len(messages_data)}")
-                return True
-            else:
-                print(f"❌ JSON file was not created!")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Error saving JSON file: {e}")
-            return False
+            self.checkpoints.commit(group_id)
+        except Exception:
+            self.checkpoints.discard(group_id)
+            raise
+        finally:
+            for _, _, job in pipeline:
+                job.cancel()
+            await batches.aclose()
+            for sink in sinks:
+                sink.close()
+        
+        return total
+    
+    async def _apply_features(self, group_id, batch, job):
+        """Fill a batch from its AnalyticsStage job: analytics columns, then clusters in message order"""
+        with metrics.timer('stage', stage='analytics'):
+            results, signatures = await job
+        if results is not None:
+            self.analytics.apply(batch, results)
+        if signatures is not None:
+            for record, signature in zip(batch, signatures):
+                record.cluster_id = self.dedup.assign(group_id, record.id, signature)
+    
+    def _write_batch(self, group_id, batch, progress, sinks, total, pipeline=()):
+        """
+        Write one batch to every sink, then commit the progress it carries.
+        `pipeline` holds the (batch, progress, job) entries still queued
+        behind it, whose rows are extracted but not yet written.
+        """
+        started = time.perf_counter()
+        rows = batch
+        if self.canonical_only:
+            rows = [r for r in batch if self.dedup.is_canonical(group_id, r)]
+        if self.media is not None and self.media.failed_paths:
+            # Rows still waiting to be written never point at a failed download
+            for record in batch:
+                if record.media_path in self.media.failed_paths:
+                    record.media_path = None
+        fixups = subtrees = None
+        if self.threads is not None:
+            threads = self.thread_index(group_id)
+            fixups, subtrees = threads.take_fixups(), threads.take_subtrees()
+        if fixups:
+            # Parents found since these rows were fetched fix them before they are written
+            for pending in (batch, *(queued for queued, _, _ in pipeline)):
+                for record in pending:
+                    if record.id in fixups:
+                        record.thread_id, record.depth = fixups[record.id]
+        for sink in sinks:
+            sink.write_batch(rows)
+            if fixups or subtrees:
+                sink.update_threads(fixups, subtrees)
+        if self.links is not None:
+            self.links.flush()
+        if self.dedup is not None:
+            self.dedup.flush()
+        self.checkpoints.commit(group_id, progress)
+        metrics.observe('stage', time.perf_counter() - started, stage='write')
+        metrics.inc('rows_written', len(rows))
+        log_event('write', rows=len(rows), total=total + len(batch))
+        
+        if not total:
+            # Show sample of messages
+            print(f"{group_prefix()}📋 Sample messages:")
+            for i, msg in enumerate(batch[:3]):
+                preview = msg.text[:50] + "..." if len(msg.text) > 50 else msg.text
+                print(f"{group_prefix()}   {i+1}. [{msg.date_text}] {msg.sender}: {preview}")
+        return len(batch)
     
-    async def scrape_group_by_link(self, invite_link, output_format='both', months_back=6):
+    async def scrape_group_by_link(self, invite_link, output_format='both', months_back=6, shards=1,
+                                   since=None, until=None):
         """
         Main method to scrape group messages using invite link
         """
+        try:
+            print("🔗 Connecting to Telegram...")
+            await self.connect()
+            await self.scrape_group(invite_link, output_format, months_back, shards, since, until)
+            if self.media:
+                await self._drain_media()
+            self._report_duplicates()
+            
+        except Exception as e:
+            print(f"❌ Error during scraping: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            print("🔌 Disconnecting from Telegram...")
+            if self.media:
+                self.media.close()
+            if self.analytics:
+                self.analytics.close()
+            await self.pool.disconnect()
+    
+    async def scrape_groups(self, targets, output_format='both', months_back=6, shards=1,
+                            since=None, until=None):
+        """
+        Scrape several groups concurrently over a single connection.
+        Each group runs as its own task; the shared scheduler keeps the
+        total number of RPCs in flight capped and split fairly.
+        """
         try:
             print("🔗 Connecting to Telegram...")
             await self.connect()
             
-            print("👥 Accessing group from invite link...")
-            group_entity = await self.join_group_by_link(invite_link)
+            print(f"🚀 Scraping {len(targets)} groups concurrently "
+                  f"(max {self.scheduler.max_in_flight} requests in flight)")
+            results = await asyncio.gather(
+                *(self._scrape_target(target, output_format, months_back, shards, since, until)
+                  for target in targets)
+            )
+            
+            print(f"\n🎉 Multi-group scraping completed!")
+            for target, total in zip(targets, results):
+                if total is None:
+                    print(f"   ❌ {target}: failed")
+                else:
+                    print(f"   ✅ {target}: {total} messages")
+            for line in self.pool.stats():
+                print(f"   ⚡ {line}")
+            if self.media:
+                await self._drain_media()
+            self._report_duplicates()
+            return results
+            
+        except Exception as e:
+            print(f"❌ Error during scraping: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            print("🔌 Disconnecting from Telegram...")
+            if self.media:
+                self.media.close()
+            if self.analytics:
+                self.analytics.close()
+            await self.pool.disconnect()
+    
+    async def _scrape_target(self, target, output_format, months_back, shards, since, until):
+        """Task body for one group in scrape_groups"""
+        current_group.set(target)
+        current_account.set(self.pool.assign())
+        try:
+            return await self.scrape_group(target, output_format, months_back, shards, since, until)
+        except Exception as e:
+            print(f"{group_prefix()}❌ Error during scraping: {e}")
+            return None
+    
+    def resolution_key(self, target):
+        """Cache key for a target: its invite hash, else the target itself"""
+        return self.extract_invite_hash(target) or target.strip().lower()
+    
+    def cached_group(self, target):
+        """Group entity for a target from the resolution cache, without any RPC"""
+        return self.resolutions.entity(self.resolution_key(target), self.pool.current())
+    
+    async def resolve_target(self, target):
+        """
+        Turn an invite link, @username, public t.me link or numeric
+        group id into a group entity, and cache how it was reached
+        """
+        group_entity = await self._lookup_target(target)
+        if group_entity:
+            self.resolutions.store(self.resolution_key(target), self.pool.current(), group_entity)
+        return group_entity
+    
+    async def _lookup_target(self, target):
+        """Resolve a target over the network"""
+        if self.extract_invite_hash(target):
+            print(f"{group_prefix()}👥 Accessing group from invite link...")
+            group_entity = await self.join_group_by_link(target)
             
-            if not group_entity:
+            if not group_entity and current_group.get() is None:
                 print("❌ Could not access the group from invite link!")
                 print("🔍 Trying to find group in existing dialogs...")
                 group_entity = await self.find_group_in_dialogs()
-                
-                if not group_entity:
-                    print("❌ Could not find target group!")
-                    return
-            
-            group_name = getattr(group_entity, 'title', 'telegram_group')
-            print(f"✅ Successfully accessed group: '{group_name}'")
-            
-            # Test if we can actually read messages from this group
-            print("🧪 Testing message access...")
+            return group_entity
+        
+        print(f"{group_prefix()}👥 Resolving group {target}...")
+        peer = int(target) if target.lstrip('-').isdigit() else target
+        try:
+            return await self.scheduler.call(self.client.get_entity, peer)
+        except (ValueError, TypeError) as e:
+            print(f"{group_prefix()}❌ Could not resolve group {target}: {e}")
+            return None
+    
+    async def scrape_group(self, target, output_format='both', months_back=6, shards=1, since=None, until=None):
+        """
+        Scrape one group on an already connected client.
+        Returns the number of messages exported, or None if the group
+        could not be accessed.
+        """
+        group_entity = self.cached_group(target)
+        from_cache = group_entity is not None
+        if from_cache:
+            print(f"{group_prefix()}⚡ Using cached group lookup for {target}")
+        else:
+            group_entity = await self.resolve_target(target)
+        if not group_entity:
+            print(f"{group_prefix()}❌ Could not find target group!")
+            return None
+        
+        self.pool.remember(self.pool.current(), group_entity)
+        self.group_targets[utils.get_peer_id(group_entity)] = target
+        
+        group_name = getattr(group_entity, 'title', 'telegram_group')
+        if current_group.get() is not None:
+            current_group.set(group_name)
+        print(f"{group_prefix()}✅ Successfully accessed group: '{group_name}'")
+        
+        # Test if we can actually read messages from this group; a cached
+        # group was readable last time, so its first page is the test
+        if not from_cache:
+            print(f"{group_prefix()}🧪 Testing message access...")
             try:
-                test_history = await self.client(GetHistoryRequest(
+                test_history = await self.rpc(GetHistoryRequest(
                     peer=group_entity,
                     offset_id=0,
                     offset_date=None,
@@ -410,66 +3054,157 @@ class TelegramScraper:
                 ))
                 
                 if test_history.messages:
-                    print(f"✅ Message access test successful! Found {len(test_history.messages)} test message(s)")
+                    print(f"{group_prefix()}✅ Message access test successful! Found {len(test_history.messages)} test message(s)")
                 else:
-                    print("⚠️  No messages found in test request")
+                    print(f"{group_prefix()}⚠️  No messages found in test request")
                     
             except Exception as e:
-                print(f"❌ Cannot access messages from this group: {e}")
+                print(f"{group_prefix()}❌ Cannot access messages from this group: {e}")
+                return None
+        
+        # Create output filename
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        sinks = self.create_sinks(output_format, f"{safe_filename(group_name)}_{timestamp}", group_entity)
+        
+        # Get messages, writing each batch to disk as it arrives
+        print(f"{group_prefix()}📥 Starting to fetch messages...")
+        print(f"{group_prefix()}💾 Streaming to: {', '.join(sink.filename for sink in sinks)}")
+        try:
+            total = await self.export_messages(group_entity, sinks, months_back, shards=shards,
+                                               since=since, until=until)
+        except ACCESS_ERRORS as e:
+            if not from_cache:
+                raise
+            print(f"{group_prefix()}♻️  Cached group lookup is stale ({e}), resolving again...")
+            self.resolutions.forget(self.resolution_key(target))
+            return await self.scrape_group(target, output_format, months_back, shards, since, until)
+        
+        print(f"{group_prefix()}📊 Total messages retrieved: {total}")
+        
+        if not total:
+            print(f"{group_prefix()}❌ No messages found in the specified time period!")
+            return 0
+        
+        files_saved = 0
+        for sink in sinks:
+            print(f"\n{group_prefix()}📄 {sink.label} file:")
+            if self._report_sink(sink):
+                files_saved += 1
+        
+        print(f"\n{group_prefix()}🎉 Scraping completed!")
+        print(f"{group_prefix()}   📊 Messages scraped: {total}")
+        print(f"{group_prefix()}   💾 Files saved: {files_saved}")
+        if since or until:
+            print(f"{group_prefix()}   📅 Date range: {describe_window(since, until, months_back)}")
+        else:
+            print(f"{group_prefix()}   📅 Date range: Last {months_back} months")
+        
+        return total
+    
+    async def tail(self, targets, output_format='jsonl', flush_interval=5, max_batch=100):
+        """
+        Follow groups live instead of re-scraping them.
+        New and edited messages arrive as update events, go through
+        extract_message_data and are appended to each group's sinks in
+        small batches. Edits are written again under the same id (the
+        SQLite archive upserts them). Runs until disconnected or interrupted.
+        """
+        buffers = {}
+        
+        async def on_message(event):
+            buffer = buffers.get(event.chat_id)
+            if buffer is None:
                 return
-            
-            # Get messages
-            print("📥 Starting to fetch messages...")
-            messages = await self.get_group_messages(group_entity, months_back)
-            
-            print(f"📊 Total messages retrieved: {len(messages)}")
-            
-            if not messages:
-                print("❌ No messages found in the specified time period!")
+            message = event.message
+            # Updates carry the sender entity, so the cache rarely misses
+            if message.sender is not None:
+                self.senders.ingest(users=[message.sender])
+            record = await self.extract_message_data(message)
+            metrics.inc('messages')
+            # Live traffic is light enough to analyse and sign inline
+            if self.analytics is not None and self.analytics.analyze:
+                self.analytics.apply([record], analyze_texts((record.text,)))
+            if self.dedup is not None:
+                record.cluster_id = self.dedup.assign(event.chat_id, record.id, self.dedup.signature(message.message))
+            if self.canonical_only and not self.dedup.is_canonical(event.chat_id, record):
                 return
+            buffer.add(record)
+        
+        try:
+            print("🔗 Connecting to Telegram...")
+            await self.connect()
             
-            # Show sample of messages
-            print("📋 Sample messages:")
-            for i, msg in enumerate(messages[:3]):
-                preview = msg['text'][:50] + "..." if len(msg['text']) > 50 else msg['text']
-                print(f"   {i+1}. [{msg['date']}] {msg['sender']}: {preview}")
-            
-            # Create output filename
-            safe_group_name = "".join(c for c in group_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            if not safe_group_name:
-                safe_group_name = "telegram_group"
-                
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            for target in targets:
+                group_entity = self.cached_group(target) or await self.resolve_target(target)
+                if not group_entity:
+                    print(f"❌ Could not access {target}, skipping it")
+                    continue
+                
+                self.pool.remember(self.pool.current(), group_entity)
+                group_name = getattr(group_entity, 'title', 'telegram_group')
+                sinks = self.create_sinks(output_format, f"{safe_filename(group_name)}_live_{timestamp}", group_entity)
+                buffers[utils.get_peer_id(group_entity)] = LiveBuffer(sinks, max_batch)
+                print(f"👂 Tailing '{group_name}' into: {', '.join(sink.filename for sink in sinks)}")
             
-            print(f"💾 Preparing to save files...")
-            
-            # Save data
-            files_saved = 0
-            
-            if output_format in ['csv', 'both']:
-                csv_filename = f"{safe_group_name}_{timestamp}.csv"
-                print(f"\n📄 Saving CSV file...")
-                if await self.save_to_csv(messages, csv_filename):
-                    files_saved += 1
+            if not buffers:
+                print("❌ No groups to tail!")
+                return
             
-            if output_format in ['json', 'both']:
-                json_filename = f"{safe_group_name}_{timestamp}.json"
-                print(f"\n📄 Saving JSON file...")
-                if await self.save_to_json(messages, json_filename):
-                    files_saved += 1
+            chats = list(buffers)
+            self.client.add_event_handler(on_message, events.NewMessage(chats=chats))
+            self.client.add_event_handler(on_message, events.MessageEdited(chats=chats))
+            print(f"📡 Listening for new messages (flushing every {flush_interval}s, Ctrl+C to stop)...")
             
-            print(f"\n🎉 Scraping completed!")
-            print(f"   📊 Messages scraped: {len(messages)}")
-            print(f"   💾 Files saved: {files_saved}")
-            print(f"   📅 Date range: Last {months_back} months")
+            flusher = asyncio.create_task(self._flush_live(buffers, flush_interval))
+            try:
+                await self.client.run_until_disconnected()
+            finally:
+                flusher.cancel()
+            if self.media:
+                await self._drain_media()
+            self._report_duplicates()
             
         except Exception as e:
-            print(f"❌ Error during scraping: {e}")
+            print(f"❌ Error while tailing: {e}")
             import traceback
             traceback.print_exc()
         finally:
+            for buffer in buffers.values():
+                buffer.close()
+                for sink in buffer.sinks:
+                    if sink.count:
+                        print(f"✅ {sink.label}: {sink.count} live messages in {os.path.abspath(sink.filename)}")
+            if self.links is not None:
+                self.links.flush()
+            if self.dedup is not None:
+                self.dedup.flush()
             print("🔌 Disconnecting from Telegram...")
-            await self.client.disconnect()
+            if self.media:
+                self.media.close()
+            if self.analytics:
+                self.analytics.close()
+            await self.pool.disconnect()
+    
+    async def _flush_live(self, buffers, flush_interval):
+        """Periodically write out live batches that have waited long enough"""
+        while True:
+            await asyncio.sleep(min(flush_interval, 1))
+            for buffer in buffers.values():
+                if buffer.due(flush_interval):
+                    try:
+                        buffer.flush()
+                    except Exception as e:
+                        print(f"❌ Error writing live messages: {e}")
+            if self.links is not None:
+                self.links.flush()
+            if self.dedup is not None:
+                self.dedup.flush()
+
+def safe_filename(group_name):
+    """File name stem for a group title"""
+    safe_group_name = "".join(c for c in group_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return safe_group_name or "telegram_group"
 
 def create_env_file():
     """
@@ -489,6 +3224,11 @@ TELEGRAM_PHONE_NUMBER=+628123456789
 # TELEGRAM_API_ID=12345678
 # TELEGRAM_API_HASH=abcd1234efgh5678ijkl9012mnop3456
 # TELEGRAM_PHONE_NUMBER=+628123456789
+
+# Optional extra accounts for the account pool (session_2, session_3, ...)
+# TELEGRAM_API_ID_2=87654321
+# TELEGRAM_API_HASH_2=ponm6543lkji2109hgfe8765dcba4321
+# TELEGRAM_PHONE_NUMBER_2=+628987654321
 """
         
         with open(env_file, 'w') as f:
@@ -500,15 +3240,84 @@ TELEGRAM_PHONE_NUMBER=+628123456789
     
     return True
 
+def load_targets(path):
+    """
+    Read scrape targets from a file: one invite link, @username or
+    group id per line. Blank lines and # comments are ignored.
+    """
+    targets = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line and line not in targets:
+                targets.append(line)
+    return targets
+
+def parse_args():
+    """Command line options for the scraper"""
+    parser = argparse.ArgumentParser(description="Telegram Group Scraper")
+    parser.add_argument('--targets', help="file with one invite link, @username or group id per line")
+    parser.add_argument('--format', default='both', help="csv, json, jsonl, sqlite, parquet, both, or a comma separated list")
+    parser.add_argument('--archive', default='telegram_archive.db', help="SQLite archive used by the sqlite format")
+    parser.add_argument('--months', type=int, default=6, help="months of history to fetch")
+    parser.add_argument('--max-in-flight', type=int, default=4, help="cap on concurrent API requests")
+    parser.add_argument('--shards', type=int, default=1, help="parallel id ranges for backfilling a large group")
+    parser.add_argument('--since', type=parse_date, help="first day to fetch (YYYY-MM-DD), overrides --months")
+    parser.add_argument('--until', type=parse_date, help="fetch only messages before this day (YYYY-MM-DD)")
+    parser.add_argument('--quick-connect', action='store_true', help="reuse a saved session without fetching the account profile")
+    parser.add_argument('--media', metavar='DIR', help="also download photos and documents into DIR")
+    parser.add_argument('--media-workers', type=int, default=3, help="concurrent media downloads")
+    parser.add_argument('--media-rate', type=int, help="cap on media download speed in KB/s")
+    parser.add_argument('--dedup', action='store_true', help="tag near-duplicate messages with a cluster_id")
+    parser.add_argument('--canonical-only', action='store_true', help="export only the first copy of each near-duplicate cluster")
+    parser.add_argument('--threads', action='store_true', help="add reply thread ids and depths to the export")
+    parser.add_argument('--analytics', action='store_true', help="add language and airdrop keyword score columns")
+    parser.add_argument('--workers', type=int, help="analytics and dedup worker processes (default: all cores)")
+    parser.add_argument('--compress', choices=['gzip', 'zstd'], help="compress csv/json/jsonl output while it streams")
+    parser.add_argument('--rotate-mb', type=float, help="start a new numbered csv/json/jsonl chunk after this many MB")
+    parser.add_argument('--rotate-rows', type=int, help="start a new numbered csv/json/jsonl chunk after this many rows")
+    parser.add_argument('--links', action='store_true', help="index links, handles, addresses and $tickers for --lookup")
+    parser.add_argument('--lookup', metavar='TERM', help="list messages indexed by --links that mention a link, @handle, address or $ticker, then exit")
+    parser.add_argument('--tail', action='store_true', help="follow the groups live instead of fetching history")
+    parser.add_argument('--flush-interval', type=float, default=5, help="seconds between live writes in --tail mode")
+    parser.add_argument('--verbose', action='store_true', help="log every fetched page and written batch as JSON lines")
+    parser.add_argument('--stats-interval', type=float, default=30, help="seconds between JSON stats lines on stderr (0 disables)")
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this local port while running")
+    args = parser.parse_args()
+    if args.since and args.until and args.since >= args.until:
+        parser.error("--since must be before --until")
+    return args
+
+def setup_logging(verbose=False):
+    """Send the scraper's JSON progress events to stderr"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG if verbose else logging.INFO)
+    log.propagate = False
+
 async def main():
     """
     Main function to run the scraper
     """
+    args = parse_args()
+    
+    if args.lookup:
+        # Answered from the local link index, no Telegram connection needed
+        hits = LinkIndex().lookup(args.lookup)
+        if not hits:
+            print(f"🔍 No archived messages mention {args.lookup}")
+        for (kind, value), messages in hits.items():
+            print(f"🔍 {kind} {value}: {len(messages)} messages")
+            for group_id, message_id in messages:
+                print(f"   group {group_id} message {message_id}")
+        return
+    
     print("🤖 === Telegram Group Scraper (Environment Variables) ===")
     print("This script will:")
     print("1. Read credentials from .env file")
     print("2. Join the group using the invite link")
-    print("3. Extract messages from the last 6 months")
+    print(f"3. Extract messages from the last {args.months} months")
     print("4. Save data to CSV and JSON files")
     print("=" * 65)
     
@@ -522,20 +3331,79 @@ async def main():
     
     try:
         # Create scraper instance (will load from .env automatically)
-        scraper = TelegramScraper()
+        media = None
+        if args.media:
+            media = MediaDownloader(args.media, workers=args.media_workers,
+                                    max_bytes_per_second=args.media_rate * 1024 if args.media_rate else None)
+        dedup = DuplicateIndex() if args.dedup or args.canonical_only else None
+        # Dedup signatures share the analytics worker pool
+        analytics = None
+        if args.analytics or dedup is not None:
+            analytics = AnalyticsStage(args.workers, analyze=args.analytics)
+        scraper = TelegramScraper(max_in_flight=args.max_in_flight, archive_file=args.archive,
+                                  quick_connect=args.quick_connect, media=media,
+                                  link_index_file='link_index.jsonl' if args.links else None,
+                                  dedup=dedup, canonical_only=args.canonical_only, threads=args.threads,
+                                  analytics=analytics,
+                                  compression=args.compress,
+                                  rotate_bytes=int(args.rotate_mb * 1024 * 1024) if args.rotate_mb else None,
+                                  rotate_rows=args.rotate_rows)
         
         print(f"⚙️  Configuration loaded from .env file")
-        print(f"🔗 Group Link: {GROUP_INVITE_LINK}")
-        print(f"📅 Time Range: Last 6 months")
-        print(f"💾 Output: CSV and JSON files")
+        if args.targets:
+            targets = load_targets(args.targets)
+            print(f"🎯 Targets: {len(targets)} groups from {args.targets}")
+        else:
+            targets = None
+            print(f"🔗 Group Link: {GROUP_INVITE_LINK}")
+        if args.since or args.until:
+            print(f"📅 Time Range: {describe_window(args.since, args.until, args.months)}")
+        else:
+            print(f"📅 Time Range: Last {args.months} months")
+        print(f"💾 Output: {args.format}")
+        
+        setup_logging(args.verbose)
+        reporter = asyncio.create_task(metrics.report_every(args.stats_interval)) if args.stats_interval > 0 else None
+        server = None
+        if args.metrics_port:
+            server = await metrics.serve(args.metrics_port)
+            print(f"📈 Metrics: http://127.0.0.1:{args.metrics_port}/metrics")
         print()
         
         # Run scraper
-        await scraper.scrape_group_by_link(
-            invite_link=GROUP_INVITE_LINK,
-            output_format='both',
-            months_back=6
-        )
+        try:
+            if args.tail:
+                await scraper.tail(
+                    targets or [GROUP_INVITE_LINK],
+                    output_format=args.format,
+                    flush_interval=args.flush_interval
+                )
+            elif targets:
+                await scraper.scrape_groups(
+                    targets,
+                    output_format=args.format,
+                    months_back=args.months,
+                    shards=args.shards,
+                    since=args.since,
+                    until=args.until
+                )
+            else:
+                await scraper.scrape_group_by_link(
+                    invite_link=GROUP_INVITE_LINK,
+                    output_format=args.format,
+                    months_back=args.months,
+                    shards=args.shards,
+                    since=args.since,
+                    until=args.until
+                )
+        finally:
+            if reporter:
+                reporter.cancel()
+            if server:
+                server.close()
+            print()
+            for line in metrics.summary_lines():
+                print(line)
         
     except ValueError as e:
         print(f"❌ Configuration error: {e}")
@@ -545,6 +3413,9 @@ async def main():
         print("   - TELEGRAM_API_HASH should be a string")
         print("   - TELEGRAM_PHONE_NUMBER should include country code")
         
+    except OSError as e:
+        print(f"❌ Could not read targets file: {e}")
+        
     except Exception as e:
         print(f"❌ Fatal error: {e}")
         import traceback